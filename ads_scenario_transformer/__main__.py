@@ -2,6 +2,7 @@ import argparse
 from pathlib import Path
 from ads_scenario_transformer.transformer.scenario_transformer import ScenarioTransformerConfiguration, ScenarioTransformer
 from ads_scenario_transformer.openscenario.openscenario_coder import OpenScenarioEncoder
+from ads_scenario_transformer.tools.vector_map_parser import VectorMapParser
 
 
 def main():
@@ -50,6 +51,34 @@ def main():
                         action="store_true",
                         default=False,
                         help="Use the last known position as the destination.")
+    parser.add_argument(
+        "--obstacle-cache-dir",
+        required=False,
+        help="Directory caching decoded obstacle tracks per Apollo scenario.")
+    parser.add_argument(
+        "--vector-map-cache-dir",
+        required=False,
+        help="Directory caching the vector map in the lanelet2 binary format.")
+    parser.add_argument(
+        "--projection-tolerance",
+        type=float,
+        default=VectorMapParser.PROJECTION_TOLERANCE,
+        help="Largest error (in meters) of the affine projection of Apollo coordinates on the vector map, 0 always uses the exact projection.")
+    parser.add_argument(
+        "--record-workers",
+        type=int,
+        default=1,
+        help="Number of processes decompressing Apollo record chunks.")
+    parser.add_argument(
+        "--record-start-time",
+        type=float,
+        required=False,
+        help="Transform only the part of the record from this time (in seconds).")
+    parser.add_argument(
+        "--record-end-time",
+        type=float,
+        required=False,
+        help="Transform only the part of the record until this time (in seconds).")
 
     args = parser.parse_args()
 
@@ -63,7 +92,13 @@ def main():
         obstacle_waypoint_frequency_in_sec=float(
             args.obstacle_waypoint_frequency),
         disable_traffic_signal=args.disable_traffic_signal,
-        use_last_position_as_destination=args.use_last_position_destination)
+        use_last_position_as_destination=args.use_last_position_destination,
+        obstacle_cache_dir=args.obstacle_cache_dir,
+        vector_map_cache_dir=args.vector_map_cache_dir,
+        projection_tolerance=args.projection_tolerance,
+        record_workers=args.record_workers,
+        record_start_time=args.record_start_time,
+        record_end_time=args.record_end_time)
 
     transformer = ScenarioTransformer(configuration=configuration)
     scenario = transformer.transform()
@@ -0,0 +1,38 @@
+from dataclasses import dataclass
+import numpy as np
+
+
+@dataclass
+class AffineProjection:
+    """
+    Affine approximation of the projection of UTM coordinates on the lanelet map frame (UTM -> WGS84 -> map projector), fitted over the extent of one map.
+    - Within a UTM zone and an MGRS grid square, the map frame is a translation of UTM, so the fit is close to exact. error_bound tells how close it is.
+    - error_bound: the largest distance in meters between the affine and the exact projection, measured on a grid over the extent
+    """
+    matrix: np.ndarray  # shape (4, 3), maps (x - center x, y - center y, z, 1) to the map frame
+    center: np.ndarray  # UTM x, y, shape (2,)
+    lower: np.ndarray  # UTM x, y, z of the lower corner of the extent, shape (3,)
+    upper: np.ndarray  # UTM x, y, z of the upper corner of the extent, shape (3,)
+    error_bound: float
+
+    @staticmethod
+    def design_matrix(points: np.ndarray, center: np.ndarray) -> np.ndarray:
+        return np.column_stack((points[:, :2] - center, points[:, 2],
+                                np.ones(len(points))))
+
+    def covers(self, points: np.ndarray) -> np.ndarray:
+        """
+        - points: UTM x, y, z, shape (n, 3)
+        - return: whether each point is in the extent of the fit, shape (n,)
+        """
+        return np.all((points >= self.lower) & (points <= self.upper), axis=1)
+
+    def project(self, points: np.ndarray) -> np.ndarray:
+        """
+        - points: UTM x, y, z in the extent, shape (n, 3)
+        - return: projected x, y, z, shape (n, 3)
+        """
+        # elementwise instead of a matrix product, so the result of a point does not depend on the other points in the batch
+        design_matrix = AffineProjection.design_matrix(points, self.center)
+        return sum(design_matrix[:, [column]] * self.matrix[column]
+                   for column in range(self.matrix.shape[0]))
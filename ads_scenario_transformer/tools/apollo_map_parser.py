@@ -1,10 +1,19 @@
+import os
 import math
 import pickle
-from typing import List, Set, Tuple
+import hashlib
+import tempfile
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
 import networkx as nx
+import numpy as np
+import shapely
+from shapely import STRtree
 from shapely.geometry import LineString, Point
 from modules.map.proto.map_pb2 import Map
 from modules.common.proto.geometry_pb2 import PointENU
+from ads_scenario_transformer.tools.lane_geometry import LaneGeometry
+from ads_scenario_transformer.tools.error import InvalidMapError
 
 
 class ApolloMapParser:
@@ -22,22 +31,118 @@ class ApolloMapParser:
     __signal_relations: nx.Graph
     __lane_nx: nx.DiGraph
 
+    __lane_geometries: Dict[str, LaneGeometry]
+    __intersecting_lanes: Dict[str, Set[str]]
+    __segment_tree: Tuple[STRtree, np.ndarray, np.ndarray]
+    __heading_cache: OrderedDict
+    __built_structures: Dict[str, None]  # ordered set of built structures
+
     __instance = None
 
+    SNAPSHOT_VERSION = 1
+
+    # derived structures and the method building each of them
+    STRUCTURE_BUILDERS = {
+        "junctions": "load_junctions",
+        "signals": "load_signals",
+        "stop_signs": "load_stop_signs",
+        "lanes": "load_lanes",
+        "crosswalks": "load_crosswalks",
+        "relations": "parse_relations",
+        "signal_relations": "parse_signal_relations",
+        "lane_relations": "parse_lane_relations",
+        "lane_geometries": "load_lane_geometries",
+        "intersecting_lanes": "parse_intersecting_lanes",
+        "segment_tree": "load_segment_tree"
+    }
+
     def __init__(self, filepath: str) -> None:
-        self.__map = self.load_hd_map(filepath)
-        print(f"Finish to Load Apollo HD map at {filepath}")
-        self.load_junctions()
-        self.load_signals()
-        self.load_stop_signs()
-        self.load_lanes()
-        self.load_crosswalks()
-        self.parse_relations()
-        self.parse_signal_relations()
-        self.parse_lane_relations()
+        """
+        - filepath: Apollo HD map (base_map.bin), a pickled Map, or a parser snapshot written by save_snapshot
+        - Only the map is loaded here. Every derived structure (see STRUCTURE_BUILDERS) is built on first access, and get_built_structures reports which ones were built.
+        """
+        self.__heading_cache = OrderedDict()
+        self.__built_structures = dict()
+
+        loaded = self.load_hd_map(filepath)
+        if isinstance(loaded, dict):
+            self.load_snapshot(snapshot=loaded, snapshot_path=filepath)
+        else:
+            self.__map = loaded
+            print(f"Finish to Load Apollo HD map at {filepath}")
         # ApolloMapParser.__instance = self
         self.load_instance()
 
+    def __require(self, *structures: str):
+        for structure in structures:
+            if structure not in self.__built_structures:
+                getattr(self, self.STRUCTURE_BUILDERS[structure])()
+
+    def __mark_built(self, structure: str):
+        self.__built_structures[structure] = None
+
+    def get_built_structures(self) -> List[str]:
+        """
+        - return: derived structures built so far, in build order
+        """
+        return list(self.__built_structures.keys())
+
+    def build_all_structures(self):
+        self.__require(*self.STRUCTURE_BUILDERS.keys())
+
+    def share_geometry(self, directory: Optional[str] = None):
+        """
+        Move the vertex, segment length and station arrays of all lanes into one read-only memory-mapped buffer, and turn each LaneGeometry into views of it.
+        - Processes forked afterwards read the geometry from the shared page cache instead of private copies. Reading NumPy array data never writes to the pages, unlike reference counts of Python objects.
+        - The buffer file is created in directory (the temp directory by default) and unlinked right away, the mapping stays valid until every process using it exits.
+        """
+        self.__require("lane_geometries")
+        geometries = list(self.__lane_geometries.items())
+        vertex_count = sum(len(geometry.vertices) for _, geometry in geometries)
+        segment_count = sum(
+            len(geometry.segment_lengths) for _, geometry in geometries)
+        size = vertex_count * 2 + vertex_count + segment_count
+
+        fd, path = tempfile.mkstemp(prefix="apollo_lane_geometry_",
+                                    suffix=".bin",
+                                    dir=directory)
+        os.close(fd)
+        try:
+            buffer = np.memmap(path, dtype=np.float64, mode='w+', shape=(size, ))
+            vertices = buffer[:vertex_count * 2].reshape(vertex_count, 2)
+            stations = buffer[vertex_count * 2:vertex_count * 3]
+            segment_lengths = buffer[vertex_count * 3:]
+
+            vertex_offset = segment_offset = 0
+            offsets = []
+            for _, geometry in geometries:
+                n, m = len(geometry.vertices), len(geometry.segment_lengths)
+                vertices[vertex_offset:vertex_offset + n] = geometry.vertices
+                stations[vertex_offset:vertex_offset + n] = geometry.stations
+                segment_lengths[segment_offset:segment_offset +
+                                m] = geometry.segment_lengths
+                offsets.append((vertex_offset, n, segment_offset, m))
+                vertex_offset += n
+                segment_offset += m
+            buffer.flush()
+            del buffer, vertices, stations, segment_lengths
+
+            shared = np.memmap(path, dtype=np.float64, mode='r', shape=(size, ))
+        finally:
+            os.unlink(path)
+
+        vertices = shared[:vertex_count * 2].reshape(vertex_count, 2)
+        stations = shared[vertex_count * 2:vertex_count * 3]
+        segment_lengths = shared[vertex_count * 3:]
+        for (lane_id, geometry), (vertex_offset, n, segment_offset,
+                                  m) in zip(geometries, offsets):
+            self.__lane_geometries[lane_id] = LaneGeometry(
+                vertices=vertices[vertex_offset:vertex_offset + n],
+                segment_lengths=segment_lengths[segment_offset:segment_offset +
+                                                m],
+                stations=stations[vertex_offset:vertex_offset + n],
+                curve=geometry.curve)
+
     def load_hd_map(self, filepath: str):
 
         if filepath.endswith(".pickle"):
@@ -50,6 +155,109 @@ class ApolloMapParser:
         f.close()
         return map
 
+    @staticmethod
+    def source_hash(filepath: str, block_size: int = 1 << 20) -> str:
+        digest = hashlib.blake2b(digest_size=20)
+        with open(filepath, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def save_snapshot(self, snapshot_path: str, source_path: str):
+        """
+        Store the map with all derived state (relation tables, lane graph, signal relations and lane vertex arrays), so load_snapshot restores the parser from a single read.
+        - The snapshot records the size, modification time and content hash of source_path, and is rebuilt from the source when the source changes.
+        """
+        self.__require("relations", "signal_relations", "lane_relations",
+                       "lane_geometries")
+
+        source_stat = os.stat(source_path)
+        snapshot = {
+            "version": ApolloMapParser.SNAPSHOT_VERSION,
+            "source_path": os.path.abspath(source_path),
+            "source_size": source_stat.st_size,
+            "source_mtime_ns": source_stat.st_mtime_ns,
+            "source_hash": ApolloMapParser.source_hash(source_path),
+            "map": self.__map,
+            "signals_at_junction": self.__signals_at_junction,
+            "lanes_at_junction": self.__lanes_at_junction,
+            "lanes_controlled_by_signal": self.__lanes_controlled_by_signal,
+            "signal_relations": self.__signal_relations,
+            "lane_nx": self.__lane_nx,
+            "lane_vertices": {
+                lane_id: geometry.vertices
+                for lane_id, geometry in self.__lane_geometries.items()
+            }
+        }
+
+        ApolloMapParser.write_snapshot(snapshot=snapshot,
+                                       snapshot_path=snapshot_path)
+
+    @staticmethod
+    def write_snapshot(snapshot: dict, snapshot_path: str):
+        temp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, snapshot_path)
+
+    def load_snapshot(self, snapshot: dict, snapshot_path: str):
+        """
+        Restore the parser from a snapshot, or rebuild the snapshot from its source map if the snapshot is outdated.
+        - A snapshot is outdated if its version differs from SNAPSHOT_VERSION, or if its source map still exists and its content hash changed.
+        - The source map is hashed only when its size or modification time differs from the snapshot; if the content is unchanged, the snapshot is rewritten with the new stat.
+        """
+        source_path = snapshot.get("source_path")
+        source_exists = source_path is not None and os.path.exists(
+            source_path)
+        is_valid = snapshot.get(
+            "version") == ApolloMapParser.SNAPSHOT_VERSION
+        stat_changed = False
+        if is_valid and source_exists:
+            source_stat = os.stat(source_path)
+            stat_changed = snapshot.get(
+                "source_size") != source_stat.st_size or snapshot.get(
+                    "source_mtime_ns") != source_stat.st_mtime_ns
+            if stat_changed:
+                is_valid = snapshot.get(
+                    "source_hash") == ApolloMapParser.source_hash(source_path)
+
+        if not is_valid:
+            if not source_exists:
+                raise InvalidMapError(
+                    f"Outdated map snapshot {snapshot_path}, its source map {source_path} is not available"
+                )
+            print(
+                f"Warning: rebuild outdated map snapshot {snapshot_path} from {source_path}"
+            )
+            self.__map = self.load_hd_map(source_path)
+            self.save_snapshot(snapshot_path=snapshot_path,
+                               source_path=source_path)
+            return
+
+        # id dictionaries point into the map, so they are rebuilt on first access instead of being stored as copies
+        self.__map = snapshot["map"]
+        self.__signals_at_junction = snapshot["signals_at_junction"]
+        self.__lanes_at_junction = snapshot["lanes_at_junction"]
+        self.__lanes_controlled_by_signal = snapshot[
+            "lanes_controlled_by_signal"]
+        self.__signal_relations = snapshot["signal_relations"]
+        self.__lane_nx = snapshot["lane_nx"]
+        self.__lane_geometries = {
+            lane_id: LaneGeometry(vertices=vertices)
+            for lane_id, vertices in snapshot["lane_vertices"].items()
+        }
+        for structure in [
+                "relations", "signal_relations", "lane_relations",
+                "lane_geometries"
+        ]:
+            self.__mark_built(structure)
+        if stat_changed:
+            snapshot["source_size"] = source_stat.st_size
+            snapshot["source_mtime_ns"] = source_stat.st_mtime_ns
+            ApolloMapParser.write_snapshot(snapshot=snapshot,
+                                           snapshot_path=snapshot_path)
+        print(f"Finish to Load Apollo HD map snapshot at {snapshot_path}")
+
     @staticmethod
     def get_instance():
         assert not ApolloMapParser.__instance is None
@@ -58,30 +266,39 @@ class ApolloMapParser:
     def load_instance(self):
         ApolloMapParser.__instance = self
 
+    def unload_instance(self):
+        if ApolloMapParser.__instance is self:
+            ApolloMapParser.__instance = None
+
     def load_junctions(self):
         self.__junctions = dict()
         for junc in self.__map.junction:
             self.__junctions[junc.id.id] = junc
+        self.__mark_built("junctions")
 
     def load_signals(self):
         self.__signals = dict()
         for sig in self.__map.signal:
             self.__signals[sig.id.id] = sig
+        self.__mark_built("signals")
 
     def load_stop_signs(self):
         self.__stop_signs = dict()
         for ss in self.__map.stop_sign:
             self.__stop_signs[ss.id.id] = ss
+        self.__mark_built("stop_signs")
 
     def load_lanes(self):
         self.__lanes = dict()
         for l in self.__map.lane:
             self.__lanes[l.id.id] = l
+        self.__mark_built("lanes")
 
     def load_crosswalks(self):
         self.__crosswalk = dict()
         for cw in self.__map.crosswalk:
             self.__crosswalk[cw.id.id] = cw
+        self.__mark_built("crosswalks")
 
     # def parse_relations(self):
     #     # load signals at junction
@@ -109,46 +326,45 @@ class ApolloMapParser:
     #                     self.__lanes_controlled_by_signal[sid].append(lid)
 
     def parse_relations(self):
-        # load signals at junction
+        """
+        Relate signals and lanes to junctions, and lanes to signals, through the overlap ids they share.
+        - An inverted index from overlap id to signals and lanes is built in one pass over the map, so each junction and signal only looks up its own overlap ids.
+        """
+        self.__require("junctions", "signals", "lanes")
+        signals_by_overlap = self.__index_by_overlap(self.__signals)
+        lanes_by_overlap = self.__index_by_overlap(self.__lanes)
+        signal_order = {sid: i for i, sid in enumerate(self.__signals)}
+        lane_order = {lid: i for i, lid in enumerate(self.__lanes)}
+
+        # load signals and lanes at junction
         self.__signals_at_junction = {}
-        for sigk, sigv in self.__signals.items():
-            for junk, junv in self.__junctions.items():
-                if junk not in self.__signals_at_junction.keys():
-                    self.__signals_at_junction[junk] = []
-                else:
-                    if self.__is_overlap(sigv, junv):
-                        self.__signals_at_junction[junk].append(sigk)
-
-        # load lanes at junction
         self.__lanes_at_junction = {}
-        for lank, lanv in self.__lanes.items():
-            for junk, junv in self.__junctions.items():
-                if junk not in self.__lanes_at_junction.keys():
-                    self.__lanes_at_junction[junk] = []
-                else:
-                    if self.__is_overlap(lanv, junv):
-                        self.__lanes_at_junction[junk].append(lank)
+        for junk, junv in self.__junctions.items():
+            self.__signals_at_junction[junk] = self.__find_overlapping(
+                junv, signals_by_overlap, signal_order)
+            self.__lanes_at_junction[junk] = self.__find_overlapping(
+                junv, lanes_by_overlap, lane_order)
+
         # load lanes controlled by signal
         self.__lanes_controlled_by_signal = {}
-        for junk, junv in self.__junctions.items():
-            if len(self.__signals_at_junction) == 0:
-                signal_ids = []
-            else:
-                signal_ids = self.__signals_at_junction[junk]
-            if len(self.__lanes_at_junction) == 0:
-                lane_ids = []
-            else:
-                lane_ids = self.__lanes_at_junction[junk]
-            for sid in signal_ids:
-                for lid in lane_ids:
-                    if sid not in self.__lanes_controlled_by_signal.keys():
-                        self.__lanes_controlled_by_signal[sid] = []
-                    else:
-                        if self.__is_overlap(self.__signals[sid],
-                                             self.__lanes[lid]):
-                            self.__lanes_controlled_by_signal[sid].append(lid)
+        for junk in self.__junctions:
+            lane_ids = set(self.__lanes_at_junction[junk])
+            for sid in self.__signals_at_junction[junk]:
+                controlled = self.__lanes_controlled_by_signal.setdefault(
+                    sid, [])
+                controlled.extend([
+                    lid for lid in self.__find_overlapping(
+                        self.__signals[sid], lanes_by_overlap, lane_order)
+                    if lid in lane_ids and lid not in controlled
+                ])
+        self.__mark_built("relations")
 
     def parse_signal_relations(self):
+        """
+        Build the graph of signals at the same junction, EQ if they control the same lanes, NE if their lanes conflict.
+        - The graph is built on the first call of get_signals_wrt.
+        """
+        self.__require("relations")
         g = nx.Graph()
         for junk, junv in self.__junctions.items():
             if len(self.__signals_at_junction) == 0:
@@ -168,34 +384,78 @@ class ApolloMapParser:
                     elif self.is_conflict_lanes(lg1, lg2):
                         g.add_edge(sid1, sid2, v='NE')
         self.__signal_relations = g
+        self.__mark_built("signal_relations")
+
+    LANE_CONNECTION_TOLERANCE = 0.001
 
     def parse_lane_relations(self):
+        """
+        Build the lane graph from predecessor_id and successor_id of lanes, and connect lanes whose end and start points coincide.
+        - Start points are hashed on a grid of LANE_CONNECTION_TOLERANCE, so each end point is compared only with the start points in the neighboring cells instead of every other lane.
+        """
+        self.__require("lanes")
         dg = nx.DiGraph()
-        for lane1 in self.__lanes:
-            dg.add_node(lane1)
-            for lane2 in self.__lanes:
-                if lane1 == lane2:
-                    continue
-                line1 = self.get_lane_central_curve(lane1)
-                line2 = self.get_lane_central_curve(lane2)
-                s1, e1 = Point(line1.coords[0]), Point(line1.coords[-1])
-                s2, e2 = Point(line2.coords[0]), Point(line2.coords[-1])
-
-                if s1.distance(e2) < 0.001:
-                    dg.add_edge(lane2, lane1)
-                elif e1.distance(s2) < 0.001:
-                    dg.add_edge(lane1, lane2)
+        dg.add_nodes_from(self.__lanes)
+        for lane_id, lane in self.__lanes.items():
+            for successor_id in lane.successor_id:
+                if successor_id.id in self.__lanes and successor_id.id != lane_id:
+                    dg.add_edge(lane_id, successor_id.id)
+            for predecessor_id in lane.predecessor_id:
+                if predecessor_id.id in self.__lanes and predecessor_id.id != lane_id:
+                    dg.add_edge(predecessor_id.id, lane_id)
+
+        # fallback to lane geometry for connections missing in the map
+        lane_starts = dict()
+        for lane_id in self.__lanes:
+            start, _ = self.__get_lane_endpoints(lane_id)
+            lane_starts.setdefault(self.__quantize_point(start),
+                                   []).append((lane_id, start))
+
+        for lane_id in self.__lanes:
+            _, end = self.__get_lane_endpoints(lane_id)
+            cell_x, cell_y = self.__quantize_point(end)
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    for other_id, start in lane_starts.get(
+                        (cell_x + dx, cell_y + dy), []):
+                        if other_id != lane_id and math.dist(
+                                end, start) < self.LANE_CONNECTION_TOLERANCE:
+                            dg.add_edge(lane_id, other_id)
         self.__lane_nx = dg
-
-    def __is_overlap(self, obj1, obj2):
-        oid1 = set([x.id for x in obj1.overlap_id])
-        oid2 = set([x.id for x in obj2.overlap_id])
-        return oid1 & oid2 != set()
+        self.__mark_built("lane_relations")
+
+    def __get_lane_endpoints(
+            self, lane_id: str) -> Tuple[Tuple[float, float], Tuple[float, float]]:
+        points = self.__lanes[lane_id].central_curve.segment[
+            0].line_segment.point
+        return (points[0].x, points[0].y), (points[-1].x, points[-1].y)
+
+    def __quantize_point(self, point: Tuple[float, float]) -> Tuple[int, int]:
+        return (math.floor(point[0] / self.LANE_CONNECTION_TOLERANCE),
+                math.floor(point[1] / self.LANE_CONNECTION_TOLERANCE))
+
+    def __index_by_overlap(self, objects: dict) -> dict:
+        index = dict()
+        for obj_id, obj in objects.items():
+            for overlap_id in obj.overlap_id:
+                index.setdefault(overlap_id.id, set()).add(obj_id)
+        return index
+
+    def __find_overlapping(self, obj, index: dict,
+                           order: dict) -> List[str]:
+        """
+        Ids of the objects in index sharing an overlap id with obj, in map order
+        """
+        found = set()
+        for overlap_id in obj.overlap_id:
+            found |= index.get(overlap_id.id, set())
+        return sorted(found, key=order.get)
 
     def get_map(self) -> Map:
         return self.__map
 
     def get_signals_wrt(self, signal_id: str) -> Tuple[str, str]:
+        self.__require("signal_relations")
         result = list()
         for u, v, data in self.__signal_relations.edges(signal_id, data=True):
             result.append((v, data['v']))
@@ -203,105 +463,149 @@ class ApolloMapParser:
 
     def is_conflict_lanes(self, lane_id1: List[str],
                           lane_id2: List[str]) -> bool:
+        self.__require("intersecting_lanes")
+        lane_id2 = set(lane_id2)
         for lid1 in lane_id1:
-            for lid2 in lane_id2:
-                if lid1 == lid2:
-                    continue
-                lane1 = self.get_lane_central_curve(lid1)
-                lane2 = self.get_lane_central_curve(lid2)
-                if lane1.intersects(lane2):
-                    return True
+            if self.__intersecting_lanes[lid1] & lane_id2 - {lid1}:
+                return True
         return False
 
+    def parse_intersecting_lanes(self):
+        """
+        Lanes whose central curve intersects the central curve of each lane, found with one bulk query on an STRtree of all central curves
+        """
+        self.__require("lane_geometries")
+        lane_ids = list(self.__lane_geometries.keys())
+        curves = [
+            geometry.curve for geometry in self.__lane_geometries.values()
+        ]
+        tree = STRtree(curves)
+        self.__intersecting_lanes = {lid: set() for lid in lane_ids}
+        for i, j in zip(*tree.query(curves, predicate='intersects')):
+            if i != j:
+                self.__intersecting_lanes[lane_ids[i]].add(lane_ids[j])
+        self.__mark_built("intersecting_lanes")
+
+    def load_lane_geometries(self):
+        """
+        Geometry of every lane central curve
+        """
+        self.__require("lanes")
+        self.__lane_geometries = dict()
+        for lane_id, lane in self.__lanes.items():
+            points = lane.central_curve.segment[0].line_segment.point
+            self.__lane_geometries[lane_id] = LaneGeometry.from_points(points)
+        self.__mark_built("lane_geometries")
+
+    def get_lane_geometry(self, lane_id: str) -> LaneGeometry:
+        self.__require("lane_geometries")
+        return self.__lane_geometries[lane_id]
+
     def get_lane_central_curve(self, lane_id: str) -> LineString:
-        lane = self.__lanes[lane_id]
-        points = lane.central_curve.segment[0].line_segment
-        line = LineString([[x.x, x.y] for x in points.point])
-        return line
+        return self.get_lane_geometry(lane_id).curve
 
     def get_lane_length(self, lane_id: str):
         return self.get_lane_central_curve(lane_id).length
 
     def get_coordinate_and_heading(self, lane_id: str, s: float):
-        lst = self.get_lane_central_curve(lane_id)
-        ip = lst.interpolate(s)
-
-        segments = list(map(LineString, zip(lst.coords[:-1], lst.coords[1:])))
-        segments.sort(key=lambda _x: ip.distance(_x))
-        line = segments[0]
-        x1, x2 = line.xy[0]
-        y1, y2 = line.xy[1]
-
-        return PointENU(x=ip.x, y=ip.y), math.atan2(y2 - y1, x2 - x1)
+        (x, y), heading = self.get_lane_geometry(
+            lane_id).point_and_heading_at(s)
+        return PointENU(x=x, y=y), heading
 
-    HEADING_CACHE = list()
+    HEADING_LANE_DISTANCE = 0.5
+    HEADING_CACHE_SIZE = 4096
+    HEADING_CACHE_RESOLUTION = 0.001
 
     def get_heading_for_coordinate(self, x: float, y: float):
-        for _x, _y, _h in self.HEADING_CACHE:
-            if _x == x and _y == y:
-                return _h
-        min_distance = (9999999999999999, None)
-        # calculate
+        """
+        Heading of the lane segment at a coordinate
+        - The first lane in map order within HEADING_LANE_DISTANCE of the coordinate is used, otherwise the closest lane.
+        - Results are kept in a LRU cache keyed on the coordinate quantized to HEADING_CACHE_RESOLUTION.
+        """
+        key = (round(x / self.HEADING_CACHE_RESOLUTION),
+               round(y / self.HEADING_CACHE_RESOLUTION))
+        if key in self.__heading_cache:
+            self.__heading_cache.move_to_end(key)
+            return self.__heading_cache[key]
+
+        self.__require("segment_tree")
+        tree, segment_lanes, segment_vertices = self.__segment_tree
         point = Point([x, y])
-        for lane_id in self.get_lanes():
-            lst = self.get_lane_central_curve(lane_id)
-            distance = point.distance(lst)
-            if distance <= 0.5:
-                segments = list((map(LineString,
-                                     zip(lst.coords[:-1], lst.coords[1:]))))
-                segments.sort(key=lambda _x: point.distance(_x))
-                line = segments[0]
-                x1, x2 = line.xy[0]
-                y1, y2 = line.xy[1]
-                heading = math.atan2(y2 - y1, x2 - x1)
-                self.HEADING_CACHE.append((x, y, heading))
-                if len(self.HEADING_CACHE) > 20:
-                    self.HEADING_CACHE.pop(0)
-                return heading
-            elif distance < min_distance[0]:
-                min_distance = (distance, lst)
-
-        # fallback to the closest lane
-        segments = list((map(LineString, zip(lst.coords[:-1],
-                                             lst.coords[1:]))))
-        segments.sort(key=lambda _x: point.distance(_x))
-        line = segments[0]
-        x1, x2 = line.xy[0]
-        y1, y2 = line.xy[1]
+        candidates = tree.query(point,
+                                predicate='dwithin',
+                                distance=self.HEADING_LANE_DISTANCE)
+        if len(candidates) > 0:
+            distances = shapely.distance(tree.geometries[candidates], point)
+            # first lane in map order, then the closest segment of the lane, then the first segment
+            segment = candidates[np.lexsort(
+                (candidates, distances, segment_lanes[candidates]))[0]]
+        else:
+            segment = tree.nearest(point)
+
+        (x1, y1), (x2, y2) = segment_vertices[segment]
         heading = math.atan2(y2 - y1, x2 - x1)
-        self.HEADING_CACHE.append((x, y, heading))
-        if len(self.HEADING_CACHE) > 20:
-            self.HEADING_CACHE.pop(0)
+
+        self.__heading_cache[key] = heading
+        if len(self.__heading_cache) > self.HEADING_CACHE_SIZE:
+            self.__heading_cache.popitem(last=False)
         return heading
 
+    def load_segment_tree(self):
+        """
+        STRtree over the segments of all lane central curves, with the map order of the lane of each segment and the vertices of each segment with shape (n, 2, 2)
+        """
+        self.__require("lane_geometries")
+        geometries = list(self.__lane_geometries.values())
+        segment_vertices = np.concatenate([
+            np.stack((geometry.vertices[:-1], geometry.vertices[1:]), axis=1)
+            for geometry in geometries
+        ])
+        segment_lanes = np.concatenate([
+            np.full(len(geometry.vertices) - 1, lane_order)
+            for lane_order, geometry in enumerate(geometries)
+        ])
+        self.__segment_tree = (STRtree(shapely.linestrings(segment_vertices)),
+                               segment_lanes, segment_vertices)
+        self.__mark_built("segment_tree")
+
     def get_junctions(self) -> List[str]:
+        self.__require("junctions")
         return list(self.__junctions.keys())
 
     def get_lanes(self) -> List[str]:
+        self.__require("lanes")
         return list(self.__lanes.keys())
 
     def get_lane_by_id(self, l_id: str):
+        self.__require("lanes")
         return self.__lanes[l_id]
 
     def get_crosswalks(self) -> List[str]:
+        self.__require("crosswalks")
         return list(self.__crosswalk.keys())
 
     def get_crosswalk_by_id(self, cw_id: str):
+        self.__require("crosswalks")
         return self.__crosswalk[cw_id]
 
     def get_signals(self) -> List[str]:
+        self.__require("signals")
         return list(self.__signals.keys())
 
     def get_signal_by_id(self, s_id: str):
+        self.__require("signals")
         return self.__signals[s_id]
 
     def get_stop_signs(self) -> List[str]:
+        self.__require("stop_signs")
         return list(self.__stop_signs.keys())
 
     def get_stop_sign_by_id(self, ss_id: str):
+        self.__require("stop_signs")
         return self.__stop_signs[ss_id]
 
     def get_lanes_not_in_junction(self) -> Set[str]:
+        self.__require("relations")
         lanes = set(self.get_lanes())
         for junc in self.__lanes_at_junction:
             jlanes = set(self.__lanes_at_junction[junc])
@@ -309,11 +613,13 @@ class ApolloMapParser:
         return lanes
 
     def get_path_from(self, lane_id: str) -> List[List[str]]:
+        self.__require("lane_relations")
         target_lanes = self.get_lanes_not_in_junction()
         reachable = self.__get_reachable_from(lane_id)
         return [p for p in reachable if p[-1] in target_lanes]
 
     def get_junction_by_id(self, j_id: str):
+        self.__require("junctions")
         return self.__junctions[j_id]
 
     def __get_reachable_from(self, lane_id: str, depth=5):
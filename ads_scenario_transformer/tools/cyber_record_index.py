@@ -0,0 +1,189 @@
+import os
+import json
+from typing import Dict, List, Optional, Set
+from dataclasses import dataclass, asdict
+from cyber_record.record import Record
+
+
+@dataclass
+class ChunkIndex:
+    position: int  # position of the chunk body section in the record
+    begin_time: int
+    end_time: int
+    message_counts: Dict[str, int]
+
+
+@dataclass
+class ChannelIndex:
+    message_count: int
+    begin_time: int
+    end_time: int
+    chunk_positions: List[int]
+
+
+class CyberRecordIndex:
+    """
+    Per-channel chunk offsets, message counts and time bounds of a cyber record.
+    - The index is stored as a sidecar file next to the record, so the chunks of a channel can be read without scanning the whole record again.
+    - The sidecar is ignored when its version, or the size or the modification time of the record, does not match. It is then rewritten by the next pass reading every chunk of the record (see CyberRecordReader.iter_timed_messages).
+    """
+    VERSION = 1
+    SIDECAR_SUFFIX = ".index.json"
+
+    source_size: int
+    source_mtime_ns: int
+    chunks: List[ChunkIndex]
+    channels: Dict[str, ChannelIndex]
+
+    def __init__(self, source_size: int, source_mtime_ns: int,
+                 chunks: List[ChunkIndex], channels: Dict[str,
+                                                          ChannelIndex]):
+        self.source_size = source_size
+        self.source_mtime_ns = source_mtime_ns
+        self.chunks = chunks
+        self.channels = channels
+
+    @staticmethod
+    def sidecar_path(source_path: str) -> str:
+        return source_path + CyberRecordIndex.SIDECAR_SUFFIX
+
+    @staticmethod
+    def load(source_path: str) -> Optional['CyberRecordIndex']:
+        try:
+            with open(CyberRecordIndex.sidecar_path(source_path), 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        stat = os.stat(source_path)
+        if data.get("version") != CyberRecordIndex.VERSION or data.get(
+                "source_size") != stat.st_size or data.get(
+                    "source_mtime_ns") != stat.st_mtime_ns:
+            return None
+
+        return CyberRecordIndex(
+            source_size=data["source_size"],
+            source_mtime_ns=data["source_mtime_ns"],
+            chunks=[ChunkIndex(**chunk) for chunk in data["chunks"]],
+            channels={
+                name: ChannelIndex(**channel)
+                for name, channel in data["channels"].items()
+            })
+
+    @staticmethod
+    def from_chunk_headers(source_path: str,
+                           record: Record) -> 'CyberRecordIndex':
+        """
+        Index with the positions and time bounds of every chunk, taken from the chunk headers, and no channel yet.
+        - The channels are added with add_chunk_summary while the chunks are read, so the index is built by the first pass that reads the record rather than by a separate one.
+        """
+        stat = os.stat(source_path)
+        chunks = [
+            ChunkIndex(position=chunk_body_index.position,
+                       begin_time=chunk_header_index.chunk_header_cache.
+                       begin_time,
+                       end_time=chunk_header_index.chunk_header_cache.end_time,
+                       message_counts={}) for chunk_header_index,
+            chunk_body_index in record._reader.sorted_chunk_indexs
+        ]
+        return CyberRecordIndex(source_size=stat.st_size,
+                                source_mtime_ns=stat.st_mtime_ns,
+                                chunks=chunks,
+                                channels={})
+
+    @staticmethod
+    def summarize_chunk(chunk_body) -> Dict[str, List[int]]:
+        """
+        - return: channel name -> [message count, begin time, end time] of the messages in the chunk body. Messages are not decoded.
+        """
+        summary = {}
+        if chunk_body is None:
+            return summary
+
+        for single_message in chunk_body.messages:
+            name = single_message.channel_name
+            time = single_message.time
+            if name not in summary:
+                summary[name] = [1, time, time]
+                continue
+            channel = summary[name]
+            channel[0] += 1
+            channel[1] = min(channel[1], time)
+            channel[2] = max(channel[2], time)
+        return summary
+
+    def add_chunk_summary(self, chunk: ChunkIndex, summary: Dict[str,
+                                                                 List[int]]):
+        """
+        Record the channels of a chunk, see summarize_chunk. Chunks are added in record order.
+        """
+        chunk.message_counts = {
+            name: count
+            for name, (count, _, _) in summary.items()
+        }
+        for name, (count, begin_time, end_time) in summary.items():
+            if name not in self.channels:
+                self.channels[name] = ChannelIndex(
+                    message_count=count,
+                    begin_time=begin_time,
+                    end_time=end_time,
+                    chunk_positions=[chunk.position])
+                continue
+            channel = self.channels[name]
+            channel.message_count += count
+            channel.begin_time = min(channel.begin_time, begin_time)
+            channel.end_time = max(channel.end_time, end_time)
+            channel.chunk_positions.append(chunk.position)
+
+    def save(self, source_path: str):
+        data = {
+            "version": CyberRecordIndex.VERSION,
+            "source_size": self.source_size,
+            "source_mtime_ns": self.source_mtime_ns,
+            "chunks": [asdict(chunk) for chunk in self.chunks],
+            "channels": {
+                name: asdict(channel)
+                for name, channel in self.channels.items()
+            }
+        }
+
+        sidecar_path = CyberRecordIndex.sidecar_path(source_path)
+        temp_path = f"{sidecar_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(temp_path, sidecar_path)
+        except OSError as ex:
+            # The index is only an optimization, reading still works without the sidecar
+            print(f"Warning: cannot write record index at {sidecar_path}, {ex}")
+
+    def chunks_in(self,
+                  topics: Optional[Set[str]] = None,
+                  start_time: Optional[int] = None,
+                  end_time: Optional[int] = None) -> List[ChunkIndex]:
+        """
+        Chunks holding at least one message of the given topics, in record order.
+        - If topics is None, every chunk is kept.
+        - Chunks entirely before start_time or after end_time (nanoseconds) are left out.
+        """
+        return [
+            chunk for chunk in self.chunks
+            if (topics is None or any(topic in chunk.message_counts
+                                      for topic in topics)) and (
+                                          start_time is None or
+                                          chunk.end_time >= start_time) and (
+                                              end_time is None or
+                                              chunk.begin_time <= end_time)
+        ]
+
+    def chunk_positions(self,
+                        topics: Set[str],
+                        start_time: Optional[int] = None,
+                        end_time: Optional[int] = None) -> List[int]:
+        """
+        Positions of the chunks holding at least one message of the given topics, in record order, see chunks_in.
+        """
+        return [
+            chunk.position for chunk in self.chunks_in(
+                topics=topics, start_time=start_time, end_time=end_time)
+        ]
@@ -1,5 +1,15 @@
+import os
+import math
+import heapq
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from enum import Enum
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
 from cyber_record.record import Record
+from cyber_record.reader import Reader
+from cyber_record.cyber.proto.record_pb2 import ChunkBody, SingleMessage
+from ads_scenario_transformer.tools.cyber_record_index import ChunkIndex, CyberRecordIndex
 
 
 class CyberRecordChannel(Enum):
@@ -17,22 +27,575 @@ class CyberRecordChannel(Enum):
     CANBUS_CHASSIS = "/apollo/canbus/chassis"
 
 
+@dataclass
+class ChannelSummary:
+    message_count: int
+    begin_time: int
+    end_time: int
+
+
+@dataclass
+class RecordSummary:
+    begin_time: int
+    end_time: int
+    channels: Dict[str, ChannelSummary]
+
+    def message_count(self, channel: CyberRecordChannel) -> int:
+        summary = self.channels.get(channel.value)
+        return summary.message_count if summary else 0
+
+    def has_channel(self, channel: CyberRecordChannel) -> bool:
+        return self.message_count(channel) > 0
+
+
+def read_chunk_contents(
+    source_path: str,
+    positions: List[int],
+    topics: Set[str],
+    start_time: Optional[int] = None,
+    end_time: Optional[int] = None,
+    summarize: bool = False
+) -> Tuple[List[Tuple[int, str, bytes]], Optional[List[Dict[str, List[int]]]]]:
+    """
+    Worker of the parallel reader: decompress the chunk bodies at positions and return (time, topic, content) of the requested topics.
+    - Decoded protobuf messages use classes built from the descriptors in the record and cannot be pickled, so the serialized content is returned.
+    - If summarize is True, the CyberRecordIndex.summarize_chunk of every chunk is returned too, in the order of positions.
+    """
+    result = []
+    summaries = [] if summarize else None
+    with Record(source_path) as record:
+        reader = record._reader
+        for position in positions:
+            chunk_body = reader.read_chunk_body(position)
+            if summarize:
+                summaries.append(CyberRecordIndex.summarize_chunk(chunk_body))
+            if chunk_body is None:
+                continue
+            for single_message in chunk_body.messages:
+                if single_message.channel_name in topics and CyberRecordReader.is_in_window(
+                        time=single_message.time,
+                        start_time=start_time,
+                        end_time=end_time):
+                    result.append((single_message.time,
+                                   single_message.channel_name,
+                                   single_message.content))
+    return result, summaries
+
+
 class CyberRecordReader:
 
+    @staticmethod
+    def inspect(source_path: str,
+                merge_segments: bool = False) -> RecordSummary:
+        """
+        Summarize a record from its header and index only, no chunk is read.
+        - Per-channel begin/end times are taken from a valid CyberRecordIndex sidecar. Without a sidecar, the record does not store them and the record begin/end times are used as bounds.
+        - If merge_segments is True, the summaries of every segment of the recording are combined.
+        """
+        segments = CyberRecordReader.find_segments(
+            source_path) if merge_segments else [source_path]
+
+        summary = None
+        for segment in segments:
+            segment_summary = CyberRecordReader.inspect_segment(segment)
+            if summary is None:
+                summary = segment_summary
+                continue
+
+            summary.begin_time = min(summary.begin_time,
+                                     segment_summary.begin_time)
+            summary.end_time = max(summary.end_time, segment_summary.end_time)
+            for name, channel in segment_summary.channels.items():
+                if name not in summary.channels:
+                    summary.channels[name] = channel
+                    continue
+                merged = summary.channels[name]
+                merged.message_count += channel.message_count
+                merged.begin_time = min(merged.begin_time, channel.begin_time)
+                merged.end_time = max(merged.end_time, channel.end_time)
+        return summary
+
+    @staticmethod
+    def inspect_segment(source_path: str) -> RecordSummary:
+        with Record(source_path) as record:
+            begin_time = record.get_start_time()
+            end_time = record.get_end_time()
+            channel_caches = record._reader.channels
+
+        index = CyberRecordIndex.load(source_path)
+        channels = {}
+        for name, channel_cache in channel_caches.items():
+            channel_index = index.channels.get(name) if index else None
+            if channel_index:
+                channels[name] = ChannelSummary(
+                    message_count=channel_index.message_count,
+                    begin_time=channel_index.begin_time,
+                    end_time=channel_index.end_time)
+            else:
+                channels[name] = ChannelSummary(
+                    message_count=channel_cache.message_number,
+                    begin_time=begin_time,
+                    end_time=end_time)
+
+        return RecordSummary(begin_time=begin_time,
+                             end_time=end_time,
+                             channels=channels)
+
     @staticmethod
     def read_channel(source_path: str,
                      channel: CyberRecordChannel,
-                     max_count=float('inf')):
-        record = Record(source_path)
-        messages = record.read_messages(channel.value)
+                     max_count=float('inf'),
+                     workers: int = 1,
+                     start_time: Optional[int] = None,
+                     end_time: Optional[int] = None):
+        """
+        - start_time and end_time: optional bounds in nanoseconds on the record time of messages, both inclusive
+        """
+        return CyberRecordReader.read_first(source_path=source_path,
+                                            channel=channel,
+                                            count=max_count,
+                                            workers=workers,
+                                            start_time=start_time,
+                                            end_time=end_time)
+
+    @staticmethod
+    def read_first(source_path: str,
+                   channel: CyberRecordChannel,
+                   count=1,
+                   predicate: Optional[Callable[[Any], bool]] = None,
+                   merge_segments: bool = False,
+                   workers: int = 1,
+                   start_time: Optional[int] = None,
+                   end_time: Optional[int] = None) -> List:
+        """
+        Read the first count messages of a channel, or the first count messages matching predicate.
+        - Reading stops as soon as enough messages are found, so the remaining chunks are never read.
+        - With merge_segments, segments are read one after another in time order (see iter_merged_segments), and segments whose header has no message of the channel are not read at all.
+        """
         result = []
-        count = 0
+        if count <= 0:
+            return result
 
-        for topic, message, t in messages:
-            if count > max_count:
-                break
+        for _, message in CyberRecordReader.iter_channels(
+                source_path=source_path,
+                channels=[channel],
+                merge_segments=merge_segments,
+                workers=workers,
+                start_time=start_time,
+                end_time=end_time):
+            if predicate and not predicate(message):
+                continue
             result.append(message)
-            count += 1
+            if len(result) >= count:
+                break
+        return result
+
+    @staticmethod
+    def read_first_and_last(
+            source_path: str,
+            channel: CyberRecordChannel,
+            merge_segments: bool = False,
+            start_time: Optional[int] = None,
+            end_time: Optional[int] = None
+    ) -> Tuple[Optional[Any], Optional[Any]]:
+        """
+        Read only the first and the last message of a channel, within the optional time window.
+        - Only the first and the last chunk holding the channel in the window are decoded.
+        """
+        segments = CyberRecordReader.find_segments(
+            source_path) if merge_segments else [source_path]
+
+        first = None
+        for segment in segments:
+            first = CyberRecordReader.read_segment_endpoint(
+                source_path=segment,
+                channel=channel,
+                last=False,
+                start_time=start_time,
+                end_time=end_time)
+            if first is not None:
+                break
+
+        last = None
+        for segment in reversed(segments):
+            last = CyberRecordReader.read_segment_endpoint(
+                source_path=segment,
+                channel=channel,
+                last=True,
+                start_time=start_time,
+                end_time=end_time)
+            if last is not None:
+                break
+
+        return first, last
+
+    @staticmethod
+    def read_segment_endpoint(source_path: str,
+                              channel: CyberRecordChannel,
+                              last: bool,
+                              start_time: Optional[int] = None,
+                              end_time: Optional[int] = None) -> Optional[Any]:
+        """
+        Decode only the earliest (or the latest) message of a channel in a single record file.
+        - Chunks are visited from the start (or the end) of the window until one holds a message of the channel in the window.
+        - Without a CyberRecordIndex sidecar, every chunk of the window is a candidate. No index is built, since the record is not read entirely.
+        """
+        with Record(source_path) as record:
+            reader = record._reader
+            index = CyberRecordIndex.load(source_path)
+            topics = {channel.value} if index else None
+            if not index:
+                index = CyberRecordIndex.from_chunk_headers(
+                    source_path=source_path, record=record)
+            positions = index.chunk_positions(topics=topics,
+                                              start_time=start_time,
+                                              end_time=end_time)
+            if last:
+                positions.reverse()
+
+            for position in positions:
+                chunk_body = reader.read_chunk_body(position)
+                if chunk_body is None:
+                    continue
+
+                single_messages = [
+                    single_message for single_message in chunk_body.messages
+                    if single_message.channel_name == channel.value and
+                    CyberRecordReader.is_in_window(time=single_message.time,
+                                                   start_time=start_time,
+                                                   end_time=end_time)
+                ]
+                if not single_messages:
+                    continue
+
+                endpoint = max if last else min
+                return CyberRecordReader.decode_message(
+                    reader=reader,
+                    single_message=endpoint(single_messages,
+                                            key=lambda message: message.time))
+        return None
+
+    @staticmethod
+    def iter_channel(source_path: str,
+                     channel: CyberRecordChannel) -> Iterator[Any]:
+        """
+        Yield messages of a channel one at a time instead of building a list of the whole channel.
+        """
+        for _, message in CyberRecordReader.iter_channels(
+                source_path=source_path, channels=[channel]):
+            yield message
+
+    @staticmethod
+    def iter_channels(
+        source_path: str,
+        channels: List[CyberRecordChannel],
+        merge_segments: bool = False,
+        workers: int = 1,
+        start_time: Optional[int] = None,
+        end_time: Optional[int] = None
+    ) -> Iterator[Tuple[CyberRecordChannel, Any]]:
+        """
+        Yield (channel, message) pairs of several channels in record order while walking the record only once.
+        - If merge_segments is True, the messages of every segment of the recording (see find_segments) are merged in timestamp order. Segments are opened lazily in time order (see iter_merged_segments), so a caller stopping early does not read the segments after its last message.
+        - If workers is greater than 1, chunks are decompressed in a pool of worker processes (see iter_timed_messages).
+        - If start_time or end_time (nanoseconds) is given, only messages recorded within the window are yielded.
+        """
+        if merge_segments:
+            messages = CyberRecordReader.iter_merged_segments(
+                segments=CyberRecordReader.find_segments(source_path),
+                channels=channels,
+                workers=workers,
+                start_time=start_time,
+                end_time=end_time)
+        else:
+            messages = CyberRecordReader.iter_timed_messages(
+                source_path=source_path,
+                channels=channels,
+                workers=workers,
+                start_time=start_time,
+                end_time=end_time)
+
+        for _, channel, message in messages:
+            yield channel, message
+
+    @staticmethod
+    def iter_merged_segments(
+        segments: List[str],
+        channels: List[CyberRecordChannel],
+        workers: int = 1,
+        start_time: Optional[int] = None,
+        end_time: Optional[int] = None
+    ) -> Iterator[Tuple[int, CyberRecordChannel, Any]]:
+        """
+        Yield (time, channel, message) of several record files merged in timestamp order.
+        - A segment is opened only once the merge reaches the begin time in its header, since none of its messages can come earlier. Apollo segments follow each other in time, so a caller stopping early reads only the segments up to its last message, instead of the first chunk of every segment as heapq.merge would.
+        - Messages with the same time come out in the order of segments, like heapq.merge.
+        """
+        begin_times = []
+        for segment in segments:
+            with Record(segment) as record:
+                begin_times.append(record.get_start_time())
+
+        pending = deque(
+            sorted(range(len(segments)), key=lambda order: begin_times[order]))
+        streams = {}
+        heap = []
+
+        def advance(order: int):
+            timed_message = next(streams[order], None)
+            if timed_message is not None:
+                time, channel, message = timed_message
+                heapq.heappush(heap, (time, order, channel, message))
+
+        while True:
+            while pending and (not heap or
+                               begin_times[pending[0]] <= heap[0][0]):
+                order = pending.popleft()
+                streams[order] = CyberRecordReader.iter_timed_messages(
+                    source_path=segments[order],
+                    channels=channels,
+                    workers=workers,
+                    start_time=start_time,
+                    end_time=end_time)
+                advance(order)
+
+            if not heap:
+                return
+            time, order, channel, message = heapq.heappop(heap)
+            yield time, channel, message
+            advance(order)
+
+    @staticmethod
+    def iter_timed_messages(
+        source_path: str,
+        channels: List[CyberRecordChannel],
+        workers: int = 1,
+        start_time: Optional[int] = None,
+        end_time: Optional[int] = None
+    ) -> Iterator[Tuple[int, CyberRecordChannel, Any]]:
+        """
+        Yield (time, channel, message) of a single record file in record order.
+        - Only the chunks that hold the requested channels and overlap the time window are read, using the CyberRecordIndex sidecar of the record.
+        - Without a valid sidecar, every chunk overlapping the time window is read, unless the channel list in the record header has no message of the requested channels. When that is every chunk of the record, the index is built from the chunks as they are read and saved once all of them are consumed, so the record is never read twice.
+        - If workers is greater than 1, the chunks are split into contiguous batches that worker processes decompress in parallel. Batches are consumed in record order, so the messages come out in the same order as with a single process.
+        """
+        channel_by_topic = {channel.value: channel for channel in channels}
+
+        with Record(source_path) as record:
+            reader = record._reader
+            index = CyberRecordIndex.load(source_path)
+            new_index = None
+            if index:
+                chunks = index.chunks_in(topics=set(channel_by_topic.keys()),
+                                         start_time=start_time,
+                                         end_time=end_time)
+            elif not any(reader.channels[topic].message_number > 0
+                         for topic in channel_by_topic
+                         if topic in reader.channels):
+                chunks = []
+            else:
+                new_index = CyberRecordIndex.from_chunk_headers(
+                    source_path=source_path, record=record)
+                chunks = new_index.chunks_in(start_time=start_time,
+                                             end_time=end_time)
+                if len(chunks) < len(new_index.chunks):
+                    new_index = None
+
+            if workers > 1 and len(chunks) > 1:
+                yield from CyberRecordReader.iter_parallel_messages(
+                    source_path=source_path,
+                    reader=reader,
+                    chunks=chunks,
+                    channel_by_topic=channel_by_topic,
+                    workers=workers,
+                    start_time=start_time,
+                    end_time=end_time,
+                    new_index=new_index)
+            else:
+                for chunk in chunks:
+                    chunk_body = reader.read_chunk_body(chunk.position)
+                    if new_index:
+                        new_index.add_chunk_summary(
+                            chunk=chunk,
+                            summary=CyberRecordIndex.summarize_chunk(
+                                chunk_body))
+                    yield from CyberRecordReader.iter_chunk_messages(
+                        reader=reader,
+                        chunk_body=chunk_body,
+                        channel_by_topic=channel_by_topic,
+                        start_time=start_time,
+                        end_time=end_time)
+
+        # Only reached when every chunk was consumed, an early exit leaves no partial index
+        if new_index:
+            new_index.save(source_path)
+
+    @staticmethod
+    def iter_parallel_messages(
+        source_path: str,
+        reader: Reader,
+        chunks: List[ChunkIndex],
+        channel_by_topic: Dict[str, CyberRecordChannel],
+        workers: int,
+        start_time: Optional[int] = None,
+        end_time: Optional[int] = None,
+        new_index: Optional[CyberRecordIndex] = None,
+        batches_per_worker: int = 4
+    ) -> Iterator[Tuple[int, CyberRecordChannel, Any]]:
+        """
+        Decompress the chunks in a process pool and decode the returned messages in record order.
+        - Each worker opens the record itself, only positions and serialized messages cross the process boundary.
+        - At most 2 * workers batches are in flight. The next batch is submitted only after the oldest one is consumed, so batches finished ahead of the consumer do not pile up in memory.
+        - If new_index is given, the workers also summarize every chunk and the summaries are added to new_index in record order.
+        """
+        batch_size = max(
+            1, math.ceil(len(chunks) / (workers * batches_per_worker)))
+        batches = [
+            chunks[i:i + batch_size] for i in range(0, len(chunks), batch_size)
+        ]
+        topics = set(channel_by_topic.keys())
+
+        workers = min(workers, len(batches))
+        pending_batches = deque(batches)
+        in_flight = deque()
+        executor = ProcessPoolExecutor(max_workers=workers)
+
+        def submit_next():
+            batch = pending_batches.popleft()
+            in_flight.append((batch,
+                              executor.submit(
+                                  read_chunk_contents, source_path,
+                                  [chunk.position for chunk in batch],
+                                  topics, start_time, end_time,
+                                  new_index is not None)))
+
+        try:
+            while pending_batches and len(in_flight) < 2 * workers:
+                submit_next()
+
+            while in_flight:
+                batch, future = in_flight.popleft()
+                contents, summaries = future.result()
+                if pending_batches:
+                    submit_next()
+                if new_index:
+                    for chunk, summary in zip(batch, summaries):
+                        new_index.add_chunk_summary(chunk=chunk,
+                                                    summary=summary)
+                for time, topic, content in contents:
+                    message = CyberRecordReader.decode_content(
+                        reader=reader, topic=topic, content=content)
+                    if message is not None:
+                        yield time, channel_by_topic[topic], message
+        finally:
+            # Pending batches are not needed when the consumer stops early
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    @staticmethod
+    def iter_chunk_messages(
+        reader: Reader,
+        chunk_body: Optional[ChunkBody],
+        channel_by_topic: Dict[str, CyberRecordChannel],
+        start_time: Optional[int] = None,
+        end_time: Optional[int] = None
+    ) -> Iterator[Tuple[int, CyberRecordChannel, Any]]:
+        """
+        Yield (time, channel, message) of the requested channels stored in a chunk body.
+        - Messages outside the time window are skipped before they are decoded.
+        """
+        if chunk_body is None:
+            return
+
+        for single_message in chunk_body.messages:
+            channel = channel_by_topic.get(single_message.channel_name)
+            if channel is None or not CyberRecordReader.is_in_window(
+                    time=single_message.time,
+                    start_time=start_time,
+                    end_time=end_time):
+                continue
+            message = CyberRecordReader.decode_message(
+                reader=reader, single_message=single_message)
+            if message is not None:
+                yield single_message.time, channel, message
+
+    @staticmethod
+    def is_in_window(time: int, start_time: Optional[int],
+                     end_time: Optional[int]) -> bool:
+        return (start_time is None or time >= start_time) and (
+            end_time is None or time <= end_time)
+
+    @staticmethod
+    def find_segments(source_path: str) -> List[str]:
+        """
+        Apollo splits long recordings into <name>.00000, <name>.00001, ... segments. Return all segments of the recording that source_path belongs to, in segment order.
+        """
+        directory, filename = os.path.split(source_path)
+        name, _, suffix = filename.rpartition('.')
+        if not name or not suffix.isdigit():
+            return [source_path]
+
+        segments = []
+        for sibling in os.listdir(directory or '.'):
+            sibling_name, _, sibling_suffix = sibling.rpartition('.')
+            if sibling_name == name and sibling_suffix.isdigit() and len(
+                    sibling_suffix) == len(suffix):
+                segments.append(sibling)
+
+        if filename not in segments:
+            return [source_path]
+        return [os.path.join(directory, segment) for segment in sorted(segments)]
+
+    @staticmethod
+    def decode_message(reader: Reader, single_message: SingleMessage) -> Any:
+        return CyberRecordReader.decode_content(
+            reader=reader,
+            topic=single_message.channel_name,
+            content=single_message.content)
+
+    @staticmethod
+    def decode_content(reader: Reader, topic: str, content: bytes) -> Any:
+        message_type = reader.message_type_pool.get(topic)
+        if message_type is None:
+            return None
+
+        message = message_type()
+        message.ParseFromString(content)
+        return message
+
+    @staticmethod
+    def read_channels(
+        source_path: str,
+        channels: List[CyberRecordChannel],
+        callbacks: Optional[Dict[CyberRecordChannel, Callable[[Any],
+                                                              None]]] = None,
+        merge_segments: bool = False,
+        workers: int = 1,
+        start_time: Optional[int] = None,
+        end_time: Optional[int] = None
+    ) -> Dict[CyberRecordChannel, List]:
+        """
+        Read several channels while walking the record only once.
+        - Messages of a channel that has a callback are passed to the callback, the others are collected in the returned per-channel bucket.
+        - If workers is greater than 1, chunks are decompressed in parallel and the messages are still delivered in record order.
+        - start_time and end_time: optional bounds in nanoseconds on the record time of messages, both inclusive. Chunks outside the window are not read.
+        """
+        callbacks = callbacks or {}
+        result = {
+            channel: []
+            for channel in channels if channel not in callbacks
+        }
+
+        for channel, message in CyberRecordReader.iter_channels(
+                source_path=source_path,
+                channels=channels,
+                merge_segments=merge_segments,
+                workers=workers,
+                start_time=start_time,
+                end_time=end_time):
+            if channel in callbacks:
+                callbacks[channel](message)
+            else:
+                result[channel].append(message)
         return result
 
     @staticmethod
@@ -12,3 +12,9 @@ class LaneFindingError(ASTError):
 
     def __init__(self, message):
         super().__init__(message)
+
+
+class InvalidMapError(ASTError):
+
+    def __init__(self, message):
+        super().__init__(message)
@@ -1,20 +1,32 @@
-from typing import Optional, Union, Set, List
+from typing import Dict, Optional, Union, Set, List, Sequence, Tuple
 import math
+import numpy as np
 import lanelet2
 from lanelet2.projection import MGRSProjector
 from lanelet2.core import Lanelet, LaneletMap, GPSPoint, BasicPoint2d, BasicPoint3d, getId, Point3d, TrafficLight, Point2d
 from lanelet2.geometry import distanceToCenterline2d, distance, findWithin3d, inside, length2d, findNearest, findWithin2d, to2D
 from lanelet2.routing import RoutingGraph, Route, LaneletPath
-from pyproj import Proj
+from pyproj import CRS, Transformer
+from pyproj.enums import TransformDirection
 from modules.common.proto.geometry_pb2 import PointENU, Point3D
 from modules.map.proto.map_signal_pb2 import Signal
 from openscenario_msgs import LanePosition, Orientation, ReferenceContext, BoundingBox
 from ads_scenario_transformer.tools.vector_map_parser import VectorMapParser
+from ads_scenario_transformer.tools.lanelet_index import LaneletIndex
+from ads_scenario_transformer.tools.affine_projection import AffineProjection
 from ads_scenario_transformer.tools.error import LaneFindingError
 from ads_scenario_transformer.builder.entities_builder import ASTEntityType
 
 
 class Geometry:
+    # UTM zone -> transformer from UTM to WGS84 longitude and latitude
+    utm_transformers: Dict[int, Transformer] = {}
+
+    # extent of an affine projection around the points of the map, in meters
+    AFFINE_PROJECTION_MARGIN = 100.0
+    AFFINE_PROJECTION_ELEVATION = 1000.0
+    # the error of an affine projection is measured on a grid of this size, and the fit uses every other grid point
+    AFFINE_PROJECTION_GRID_SIZE = 33
 
     @staticmethod
     def find_nearest_traffic_light(
@@ -22,10 +34,11 @@ class Geometry:
             projector: MGRSProjector) -> Optional[TrafficLight]:
 
         candidates = set()
-        for point in signal.boundary.point:
-            basic_point = Geometry.project_UTM_point_on_lanelet(
-                point=point, projector=projector)
-            basic_point2d = BasicPoint2d(basic_point.x, basic_point.y)
+        projected_points = Geometry.project_UTM_points_on_lanelet(
+            points=Geometry.to_array(signal.boundary.point),
+            projector=projector)
+        for x, y, _ in projected_points:
+            basic_point2d = BasicPoint2d(x, y)
 
             nearest_traffic_elements = findNearest(map.regulatoryElementLayer,
                                                    basic_point2d, 10)
@@ -50,81 +63,69 @@ class Geometry:
                              entity_type: ASTEntityType) -> Set[Lanelet]:
         """
         Finds all available lanes between start_point and end_point trajectory. If start_point or end_point are placed on a lanelet where multiple lanelets are overlapped, it can return wrong set of lanelets.
+        - For many target points of the same trajectory, use a LaneCorridor instead, which finds the lanelets of start_point and end_point once.
         """
-
-        def find_paths(start_lanelet: Lanelet, end_lanelet: Lanelet,
-                       target_lanelets: List[Lanelet]) -> List[LaneletPath]:
-            paths = []
-            for target_lanelet in target_lanelets:
-                start_to_end_route: Route = target_graph.getRoute(
-                    start_lanelet, end_lanelet, 0, True)
-                start_to_end_via_route: Route = target_graph.getRouteVia(
-                    start_lanelet, [target_lanelet], end_lanelet, 0, True)
-
-                if start_to_end_route:
-                    paths.append(start_to_end_route.shortestPath())
-                if start_to_end_via_route:
-                    paths.append(start_to_end_via_route.shortestPath())
-
-            return paths if paths else []
-
-        target_graph = vector_map_parser.routing_graph(entity_type)
-
-        start_lanelets = Geometry.find_close_lanelets(
-            map=vector_map_parser.lanelet_map,
-            basic_point=start_point,
-            entity_type=entity_type)
-
-        end_lanelets = Geometry.find_close_lanelets(
-            map=vector_map_parser.lanelet_map,
-            basic_point=end_point,
-            entity_type=entity_type)
+        lane_corridor = LaneCorridor(vector_map_parser=vector_map_parser,
+                                     start_point=start_point,
+                                     end_point=end_point,
+                                     entity_type=entity_type)
 
         target_lanelets = Geometry.find_close_lanelets(
-            map=vector_map_parser.lanelet_map,
+            lanelet_index=vector_map_parser.lanelet_index,
             basic_point=target_point,
             entity_type=entity_type)
 
-        lanelets = set()
-        for start_lanelet in start_lanelets:
-            for end_lanelet in end_lanelets:
-                paths = find_paths(start_lanelet, end_lanelet, target_lanelets)
-
-                for path in paths:
-                    for lane in path:
-                        lanelets.add(lane)
-        return lanelets
+        return set(
+            lane_corridor.available_lanelets(
+                target_lanelets=target_lanelets).values())
 
     @staticmethod
-    def find_close_lanelets(map: LaneletMap, basic_point: BasicPoint3d,
+    def find_close_lanelets(lanelet_index: LaneletIndex,
+                            basic_point: BasicPoint3d,
                             entity_type: ASTEntityType) -> List[Lanelet]:
-        found_lanes = findWithin3d(layer=map.laneletLayer,
+        lanelet_layer = lanelet_index.lanelet_map.laneletLayer
+        found_lanes = findWithin3d(layer=lanelet_layer,
                                    geometry=basic_point,
                                    maxDist=1)
 
-        subtypes = entity_type.available_lanelet_subtype()
         if found_lanes:
             lanelets = [
                 lanelet[1] for lanelet in found_lanes
-                if "subtype" in lanelet[1].attributes
-                and lanelet[1].attributes["subtype"] in subtypes
+                if lanelet_index.has_subtype(lanelet[1], entity_type)
             ]
 
             if lanelets:
                 return lanelets
 
-        assert len(map.laneletLayer) > 20
+        assert len(lanelet_layer) > 20
 
-        for nearby_count in [1, 10] + list(range(20, len(map.laneletLayer),
-                                                 20)):
-            basic_point2d = BasicPoint2d(basic_point.x, basic_point.y)
-            found_lanes_2d = findNearest(map.laneletLayer, basic_point2d,
+        # Lanelets of the available subtypes among the nearest nearby_count lanelets, for the smallest nearby_count with any.
+        # The nearest lanelet of the available subtypes comes from the subtype index, so the windows without it are skipped instead of queried.
+        basic_point2d = BasicPoint2d(basic_point.x, basic_point.y)
+        nearest_lanes = findNearest(
+            lanelet_index.subtype_maps[entity_type].laneletLayer,
+            basic_point2d, 1)
+        if not nearest_lanes:
+            raise LaneFindingError(
+                f"Could not find close lanelets for point {basic_point} type {entity_type} in the map"
+            )
+        nearest_distance = nearest_lanes[0][0]
+        closer_count = sum(1 for lanelet in findWithin2d(
+            lanelet_layer, basic_point2d, nearest_distance)
+                           if lanelet[0] < nearest_distance)
+
+        nearby_counts = [1, 10] + list(range(20, len(lanelet_layer),
+                                             20)) + [len(lanelet_layer)]
+        for nearby_count in nearby_counts:
+            if nearby_count <= closer_count:
+                continue
+
+            found_lanes_2d = findNearest(lanelet_layer, basic_point2d,
                                          nearby_count)
 
             lanelets = [
                 lanelet[1] for lanelet in found_lanes_2d
-                if "subtype" in lanelet[1].attributes
-                and lanelet[1].attributes["subtype"] in subtypes
+                if lanelet_index.has_subtype(lanelet[1], entity_type)
             ]
             if lanelets:
                 return lanelets
@@ -165,53 +166,270 @@ class Geometry:
         return None
 
     @staticmethod
-    def nearest_lane_position(map: LaneletMap,
+    def nearest_lane_position(lanelet_index: LaneletIndex,
                               lanelet: Lanelet,
                               basic_point: BasicPoint3d,
                               entity_bounding_box: BoundingBox,
                               heading=0.0) -> Optional[LanePosition]:
-        point3d = Point3d(getId(), basic_point.x, basic_point.y, basic_point.z)
-        basic_point2d = BasicPoint2d(basic_point.x, basic_point.y)
-
-        if not inside(lanelet, basic_point2d):
-            # If the point is not in lanelet, we find nearest one and use it
-            nearest_point_in_lanelets = findNearest(map.pointLayer,
-                                                    basic_point2d, 1)
-            if not nearest_point_in_lanelets:
-                return None
-
-            nearest_point = nearest_point_in_lanelets[0][1]
-            basic_point2d = BasicPoint2d(nearest_point.x, nearest_point.y)
+        """
+        Position of basic_point on lanelet
+        - s and offset are the arc coordinates of the point on the centerline of the lanelet. A point outside the lanelet is placed on the centerline (offset 0).
+        """
+        centerline = lanelet_index.centerline(lanelet)
+        s, offset = centerline.arc_coordinates(basic_point.x, basic_point.y)
+        if not inside(lanelet, BasicPoint2d(basic_point.x, basic_point.y)):
+            offset = 0.0
 
         entity_length = entity_bounding_box.dimensions.length
 
         # If there is not enough space to place entity on the lane, simulator will fails.
-        max_s = max(math.floor(length2d(lanelet) - entity_length), 0)
+        max_s = max(math.floor(centerline.length - entity_length), 0)
 
-        # Calculation of s attribute is simplified.
         # https://releases.asam.net/OpenDRIVE/1.6.0/ASAM_OpenDRIVE_BS_V1-6-0.html#_reference_line_coordinate_systems
-        s_attribute = min(max_s, distance(lanelet.centerline[0], point3d))
+        s_attribute = min(max_s, s)
 
         return LanePosition(
             roadId='',
             laneId=str(lanelet.id),
             s=s_attribute,
-            offset=0,
+            offset=offset,
             orientation=Orientation(
                 h=heading,
                 p=0,
                 r=0,
                 type=ReferenceContext.REFERENCECONTEXT_RELATIVE))
 
+    @staticmethod
+    def utm_transformer(zone: int) -> Transformer:
+        if zone not in Geometry.utm_transformers:
+            crs = CRS(proj="utm", zone=zone, ellps="WGS84")
+            Geometry.utm_transformers[zone] = Transformer.from_crs(
+                crs, crs.geodetic_crs, always_xy=True)
+        return Geometry.utm_transformers[zone]
+
     @staticmethod
     def utm_to_WGS(point: Union[PointENU, Point3D], zone=10) -> GPSPoint:
-        utm_proj = Proj(proj="utm", zone=zone, ellps="WGS84")
-        lon, lat = utm_proj(point.x, point.y, inverse=True)
+        lon, lat = Geometry.utm_transformer(zone).transform(point.x, point.y)
         return GPSPoint(lat=lat, lon=lon, ele=point.z)
 
+    @staticmethod
+    def to_array(points: Sequence[Union[PointENU, Point3D]]) -> np.ndarray:
+        """
+        - return: x, y, z of points, shape (n, 3)
+        """
+        return np.array([(point.x, point.y, point.z) for point in points],
+                        dtype=np.float64).reshape(-1, 3)
+
+    @staticmethod
+    def project_UTM_points_on_lanelet(points: np.ndarray,
+                                      projector: MGRSProjector,
+                                      zone: int = 10) -> np.ndarray:
+        """
+        Project UTM coordinates on the lanelet map frame
+        - points: UTM x, y, z, shape (n, 3)
+        - return: projected x, y, z, shape (n, 3)
+        - The UTM to WGS84 step runs over all points in one pyproj call. The projector takes a single point, so the second step is a loop over the points.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        lons, lats = Geometry.utm_transformer(zone).transform(
+            points[:, 0], points[:, 1])
+
+        projected = np.empty_like(points)
+        for i, (lon, lat, ele) in enumerate(
+                zip(lons.tolist(), lats.tolist(), points[:, 2].tolist())):
+            projected_point = projector.forward(
+                GPSPoint(lat=lat, lon=lon, ele=ele))
+            projected[i] = (projected_point.x, projected_point.y,
+                            projected_point.z)
+        return projected
+
+    @staticmethod
+    def fit_affine_projection(lanelet_map: LaneletMap,
+                              projector: MGRSProjector,
+                              zone: int = 10) -> Optional[AffineProjection]:
+        """
+        Fit an affine projection to the exact projection over the extent of lanelet_map, and measure its error
+        - return: None if the map has no points
+        """
+        map_points = np.array([(point.x, point.y)
+                               for point in lanelet_map.pointLayer]).reshape(
+                                   -1, 2)
+        if len(map_points) == 0:
+            return None
+
+        # extent of the map in UTM, from the corners of its extent in the map frame
+        corners = [
+            projector.reverse(BasicPoint3d(x, y, 0.0))
+            for x in (map_points[:, 0].min(), map_points[:, 0].max())
+            for y in (map_points[:, 1].min(), map_points[:, 1].max())
+        ]
+        xs, ys = Geometry.utm_transformer(zone).transform(
+            [corner.lon for corner in corners],
+            [corner.lat for corner in corners],
+            direction=TransformDirection.INVERSE)
+        margin = Geometry.AFFINE_PROJECTION_MARGIN
+        elevation = Geometry.AFFINE_PROJECTION_ELEVATION
+        lower = np.array([min(xs) - margin, min(ys) - margin, -elevation])
+        upper = np.array([max(xs) + margin, max(ys) + margin, elevation])
+        center = (lower[:2] + upper[:2]) / 2
+
+        grid = np.stack(np.meshgrid(
+            *[
+                np.linspace(lower[axis], upper[axis],
+                            Geometry.AFFINE_PROJECTION_GRID_SIZE)
+                for axis in range(2)
+            ], [-elevation, elevation]),
+                        axis=-1).reshape(-1, 3)
+        exact = Geometry.project_UTM_points_on_lanelet(points=grid,
+                                                       projector=projector,
+                                                       zone=zone)
+        design_matrix = AffineProjection.design_matrix(grid, center)
+
+        size = Geometry.AFFINE_PROJECTION_GRID_SIZE
+        fit_indices = np.arange(len(grid)).reshape(size, size,
+                                                   2)[::2, ::2].reshape(-1)
+        matrix = np.linalg.lstsq(design_matrix[fit_indices],
+                                 exact[fit_indices],
+                                 rcond=None)[0]
+        errors = np.linalg.norm(design_matrix @ matrix - exact, axis=1)
+
+        return AffineProjection(matrix=matrix,
+                                center=center,
+                                lower=lower,
+                                upper=upper,
+                                error_bound=float(errors.max()))
+
+    @staticmethod
+    def affine_projection(
+        vector_map_parser: VectorMapParser,
+        projection_tolerance: Optional[
+            float] = VectorMapParser.PROJECTION_TOLERANCE,
+        zone: int = 10
+    ) -> Optional[AffineProjection]:
+        """
+        - projection_tolerance: largest error in meters of the affine projection. 0 (or None) disables the affine projection, even for a map whose fit is exact.
+        - return: the affine projection of the map, fitted on first use and shared by all tolerances, or None if its error exceeds projection_tolerance
+        """
+        if projection_tolerance is None or projection_tolerance <= 0:
+            return None
+
+        if zone not in vector_map_parser.affine_projections:
+            vector_map_parser.affine_projections[
+                zone] = Geometry.fit_affine_projection(
+                    lanelet_map=vector_map_parser.lanelet_map,
+                    projector=vector_map_parser.projector,
+                    zone=zone)
+        affine_projection = vector_map_parser.affine_projections[zone]
+
+        if affine_projection is None or affine_projection.error_bound > projection_tolerance:
+            return None
+        return affine_projection
+
+    @staticmethod
+    def project_UTM_points(vector_map_parser: VectorMapParser,
+                           points: np.ndarray,
+                           projection_tolerance: Optional[
+                               float] = VectorMapParser.PROJECTION_TOLERANCE,
+                           zone: int = 10) -> np.ndarray:
+        """
+        Project UTM coordinates on the map frame of vector_map_parser, with its affine projection where it is accurate enough
+        - points: UTM x, y, z, shape (n, 3)
+        - projection_tolerance: see affine_projection. It is given by each caller rather than stored on the parser, which is shared by every transformer using the map (see MapCache).
+        - return: projected x, y, z, shape (n, 3)
+        - Points outside the extent of the affine projection, or all points if the map has no accurate affine projection, take the exact path (project_UTM_points_on_lanelet).
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        affine_projection = Geometry.affine_projection(
+            vector_map_parser=vector_map_parser,
+            projection_tolerance=projection_tolerance,
+            zone=zone)
+        if affine_projection is None:
+            return Geometry.project_UTM_points_on_lanelet(
+                points=points, projector=vector_map_parser.projector, zone=zone)
+
+        covered = affine_projection.covers(points)
+        projected = np.empty_like(points)
+        projected[covered] = affine_projection.project(points[covered])
+        projected[~covered] = Geometry.project_UTM_points_on_lanelet(
+            points=points[~covered],
+            projector=vector_map_parser.projector,
+            zone=zone)
+        return projected
+
     @staticmethod
     def project_UTM_point_on_lanelet(point: Union[PointENU, Point3D],
                                      projector: MGRSProjector,
                                      zone: int = 10) -> BasicPoint3d:
-        gps_point = Geometry.utm_to_WGS(point, zone=zone)
-        return projector.forward(gps_point)
+        x, y, z = Geometry.project_UTM_points_on_lanelet(
+            points=Geometry.to_array([point]), projector=projector,
+            zone=zone)[0]
+        return BasicPoint3d(x, y, z)
+
+
+class LaneCorridor:
+    """
+    Lanelets available to an entity moving from start_point to end_point: the shortest routes from the lanelets close to start_point to the ones close to end_point, directly or through a target lanelet
+    - A corridor is made once per trajectory and answers the queries of all its points. The lanelets close to start_point and end_point are found on the first query.
+    """
+    vector_map_parser: VectorMapParser
+    start_point: BasicPoint3d
+    end_point: BasicPoint3d
+    entity_type: ASTEntityType
+    __endpoint_lanelets: Optional[Tuple[List[Lanelet], List[Lanelet]]]
+    __available_lanelets: Dict[Tuple[int, ...], Dict[int, Lanelet]]  # target lanelet ids -> available lanelets
+
+    def __init__(self, vector_map_parser: VectorMapParser,
+                 start_point: BasicPoint3d, end_point: BasicPoint3d,
+                 entity_type: ASTEntityType):
+        self.vector_map_parser = vector_map_parser
+        self.start_point = start_point
+        self.end_point = end_point
+        self.entity_type = entity_type
+        self.__endpoint_lanelets = None
+        self.__available_lanelets = {}
+
+    def endpoint_lanelets(self) -> Tuple[List[Lanelet], List[Lanelet]]:
+        """
+        - return: lanelets close to start_point and lanelets close to end_point
+        """
+        if self.__endpoint_lanelets is None:
+            start_lanelets = Geometry.find_close_lanelets(
+                lanelet_index=self.vector_map_parser.lanelet_index,
+                basic_point=self.start_point,
+                entity_type=self.entity_type)
+            end_lanelets = Geometry.find_close_lanelets(
+                lanelet_index=self.vector_map_parser.lanelet_index,
+                basic_point=self.end_point,
+                entity_type=self.entity_type)
+            self.__endpoint_lanelets = (start_lanelets, end_lanelets)
+        return self.__endpoint_lanelets
+
+    def available_lanelets(
+            self, target_lanelets: List[Lanelet]) -> Dict[int, Lanelet]:
+        """
+        - target_lanelets: lanelets close to a point of the trajectory
+        - return: lanelet id -> lanelet, empty if there are no target_lanelets
+        """
+        key = tuple(lanelet.id for lanelet in target_lanelets)
+        if key in self.__available_lanelets:
+            return self.__available_lanelets[key]
+
+        start_lanelets, end_lanelets = self.endpoint_lanelets()
+        lanelets = {}
+        if target_lanelets:
+            # the direct route, and the route through each target lanelet
+            via_lanelets_list = [[]] + [[target_lanelet]
+                                        for target_lanelet in target_lanelets]
+            for start_lanelet in start_lanelets:
+                for end_lanelet in end_lanelets:
+                    for via_lanelets in via_lanelets_list:
+                        path = self.vector_map_parser.shortest_path(
+                            type=self.entity_type,
+                            start_lanelet=start_lanelet,
+                            end_lanelet=end_lanelet,
+                            via_lanelets=via_lanelets)
+                        for lanelet in path or []:
+                            lanelets[lanelet.id] = lanelet
+
+        self.__available_lanelets[key] = lanelets
+        return lanelets
@@ -0,0 +1,108 @@
+import math
+from typing import List, Optional, Tuple
+import numpy as np
+from shapely.geometry import LineString
+
+
+class LaneGeometry:
+    """
+    Central curve of a lane as a NumPy array of vertices with the cumulative arc length at each vertex.
+    - Station (s) lookups are a binary search over the cumulative arc length instead of a distance sort over all segments.
+    - The shapely LineString of the curve is created once, on first use.
+    """
+    vertices: np.ndarray  # shape (n, 2)
+    segment_lengths: np.ndarray  # shape (n - 1,)
+    stations: np.ndarray  # arc length from the first vertex to each vertex, shape (n,)
+    __curve: Optional[LineString]
+
+    def __init__(self,
+                 vertices: np.ndarray,
+                 segment_lengths: Optional[np.ndarray] = None,
+                 stations: Optional[np.ndarray] = None,
+                 curve: Optional[LineString] = None):
+        """
+        - segment_lengths and stations are computed from vertices unless given, e.g. as views into a shared buffer
+        - curve: LineString of vertices if already built
+        """
+        self.vertices = vertices
+        if segment_lengths is None or stations is None:
+            deltas = np.diff(vertices, axis=0)
+            # same operations as GEOS, so stations match LineString.length and interpolate
+            segment_lengths = np.sqrt(deltas[:, 0] * deltas[:, 0] +
+                                      deltas[:, 1] * deltas[:, 1])
+            stations = np.concatenate(([0.0], np.cumsum(segment_lengths)))
+        self.segment_lengths = segment_lengths
+        self.stations = stations
+        self.__curve = curve
+
+    @staticmethod
+    def from_points(points: List) -> 'LaneGeometry':
+        """
+        - points: PointENU of a lane central curve segment
+        """
+        return LaneGeometry(
+            vertices=np.array([[p.x, p.y] for p in points], dtype=np.float64))
+
+    @property
+    def curve(self) -> LineString:
+        if self.__curve is None:
+            self.__curve = LineString(self.vertices)
+        return self.__curve
+
+    @property
+    def length(self) -> float:
+        return float(self.stations[-1])
+
+    def segment_index_at(self, s: float) -> int:
+        """
+        Index of the segment holding station s. At a vertex shared by two segments, the segment ending at the vertex is returned.
+        """
+        index = int(np.searchsorted(self.stations, s, side='left')) - 1
+        return min(max(index, 0), len(self.vertices) - 2)
+
+    def point_and_heading_at(self,
+                             s: float) -> Tuple[Tuple[float, float], float]:
+        """
+        Point at station s and heading of the segment holding it
+        - Like LineString.interpolate, a negative s is measured from the end of the lane and s is clamped to the lane.
+        """
+        if s < 0:
+            s += self.length
+        s = min(max(s, 0.0), self.length)
+
+        index = self.segment_index_at(s)
+        (x1, y1), (x2, y2) = self.vertices[index], self.vertices[index + 1]
+        segment_length = self.segment_lengths[index]
+        fraction = (s - self.stations[index]
+                    ) / segment_length if segment_length > 0 else 0.0
+        fraction = min(max(fraction, 0.0), 1.0)
+
+        point = (float(x1 + fraction * (x2 - x1)),
+                 float(y1 + fraction * (y2 - y1)))
+        return point, math.atan2(y2 - y1, x2 - x1)
+
+    def arc_coordinates(self, x: float, y: float) -> Tuple[float, float]:
+        """
+        Station of the point on the curve nearest to (x, y), and the signed distance from it, like lanelet2.geometry.toArcCoordinates
+        - The distance is positive on the left of the curve.
+        - Points beyond the ends of the curve are projected on the end vertices.
+        """
+        starts = self.vertices[:-1]
+        deltas = np.diff(self.vertices, axis=0)
+        squared_lengths = self.segment_lengths * self.segment_lengths
+        dx, dy = x - starts[:, 0], y - starts[:, 1]
+
+        dots = dx * deltas[:, 0] + dy * deltas[:, 1]
+        fractions = np.clip(
+            np.divide(dots,
+                      squared_lengths,
+                      out=np.zeros_like(dots),
+                      where=squared_lengths > 0), 0.0, 1.0)
+        offsets_x = dx - fractions * deltas[:, 0]
+        offsets_y = dy - fractions * deltas[:, 1]
+        index = int(np.argmin(offsets_x * offsets_x + offsets_y * offsets_y))
+
+        s = self.stations[index] + fractions[index] * self.segment_lengths[index]
+        distance = math.hypot(offsets_x[index], offsets_y[index])
+        cross = deltas[index, 0] * dy[index] - deltas[index, 1] * dx[index]
+        return float(s), math.copysign(distance, cross)
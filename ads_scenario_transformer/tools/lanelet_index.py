@@ -0,0 +1,59 @@
+from typing import Dict, FrozenSet, Set
+from lanelet2.core import Lanelet, LaneletMap, LaneletSubmap, createSubmapFromLanelets
+from ads_scenario_transformer.builder.entities_builder import ASTEntityType
+from ads_scenario_transformer.tools.lane_geometry import LaneGeometry
+
+
+class LaneletIndex:
+    """
+    Lookup tables over the lanelets of a map, built once per map
+    - lanelets: lanelet id -> lanelet
+    - attributes: attribute key -> (lanelet id -> attribute value)
+    - subtype_maps: a submap per entity type with only the lanelets of its available subtypes, so spatial queries (findWithin3d, findNearest) on its laneletLayer never return lanelets of other subtypes
+    - centerlines: lanelet id -> centerline with cumulative arc length, made on first use
+    """
+    lanelet_map: LaneletMap
+    lanelets: Dict[int, Lanelet]
+    attributes: Dict[str, Dict[int, str]]
+    subtype_ids: Dict[ASTEntityType, Set[int]]
+    subtype_maps: Dict[ASTEntityType, LaneletSubmap]
+    centerlines: Dict[int, LaneGeometry]
+
+    def __init__(self, lanelet_map: LaneletMap):
+        self.lanelet_map = lanelet_map
+        self.lanelets = {}
+        self.centerlines = {}
+        self.attributes = {}
+        for lanelet in lanelet_map.laneletLayer:
+            self.lanelets[lanelet.id] = lanelet
+            for key, value in lanelet.attributes.items():
+                self.attributes.setdefault(key, {})[lanelet.id] = value
+
+        subtypes = self.attributes.get("subtype", {})
+        # entity types with the same available subtypes share a submap
+        submaps: Dict[FrozenSet[str], LaneletSubmap] = {}
+        self.subtype_ids = {}
+        self.subtype_maps = {}
+        for entity_type in ASTEntityType:
+            available_subtypes = frozenset(
+                entity_type.available_lanelet_subtype())
+            ids = {
+                id
+                for id, subtype in subtypes.items()
+                if subtype in available_subtypes
+            }
+            if available_subtypes not in submaps:
+                submaps[available_subtypes] = createSubmapFromLanelets(
+                    [self.lanelets[id] for id in ids])
+            self.subtype_ids[entity_type] = ids
+            self.subtype_maps[entity_type] = submaps[available_subtypes]
+
+    def has_subtype(self, lanelet: Lanelet,
+                    entity_type: ASTEntityType) -> bool:
+        return lanelet.id in self.subtype_ids[entity_type]
+
+    def centerline(self, lanelet: Lanelet) -> LaneGeometry:
+        if lanelet.id not in self.centerlines:
+            self.centerlines[lanelet.id] = LaneGeometry.from_points(
+                lanelet.centerline)
+        return self.centerlines[lanelet.id]
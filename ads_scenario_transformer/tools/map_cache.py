@@ -1,22 +1,139 @@
-from typing import Optional
+import os
+import gc
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Optional, Tuple
+from ads_scenario_transformer.builder.entities_builder import ASTEntityType
 from ads_scenario_transformer.tools.apollo_map_parser import ApolloMapParser
 from ads_scenario_transformer.tools.vector_map_parser import VectorMapParser
+from ads_scenario_transformer.tools.geometry import Geometry
+
+
+@dataclass
+class MapCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+@dataclass
+class MapCacheEntry:
+    parser: Any
+    size: int  # estimated memory size in bytes
 
 
 class MapCache:
-    apollo_map_parser: Optional[ApolloMapParser] = None
-    vector_map_parser: Optional[VectorMapParser] = None
+    """
+    Parsed maps of any number of map files, keyed by the resolved path, the modification time and the size of the file.
+    - A map file changed on disk gets a new key, so a stale parser is never returned. The parser of its previous version is dropped when the new one is loaded, so it does not count against memory_budget.
+    - The least recently used parsers are evicted when the estimated size of all cached parsers exceeds memory_budget. The size of a parser is estimated from the size of its map file.
+    """
+    memory_budget: int = 4 << 30  # bytes
+    # estimated memory size of a parser per byte of its map file
+    APOLLO_MAP_SIZE_FACTOR = 20
+    VECTOR_MAP_SIZE_FACTOR = 10
+
+    entries: OrderedDict = OrderedDict()
+    stats: MapCacheStats = MapCacheStats()
 
     @staticmethod
     def get_apollo_map_parser(apollo_hd_map_path: str) -> ApolloMapParser:
-        if not MapCache.apollo_map_parser:
-            MapCache.apollo_map_parser = ApolloMapParser(
-                filepath=apollo_hd_map_path)
-        return MapCache.apollo_map_parser
+        parser = MapCache.get_parser(
+            kind="apollo",
+            filepath=apollo_hd_map_path,
+            size_factor=MapCache.APOLLO_MAP_SIZE_FACTOR,
+            load=lambda: ApolloMapParser(filepath=apollo_hd_map_path))
+        # other modules access the parser of the current map with ApolloMapParser.get_instance
+        parser.load_instance()
+        return parser
+
+    @staticmethod
+    def get_vector_map_parser(
+            vector_map_path: str,
+            map_cache_dir: Optional[str] = None) -> VectorMapParser:
+        return MapCache.get_parser(
+            kind="vector",
+            filepath=vector_map_path,
+            size_factor=MapCache.VECTOR_MAP_SIZE_FACTOR,
+            load=lambda: VectorMapParser(vector_map_path=vector_map_path,
+                                         map_cache_dir=map_cache_dir))
+
+    @staticmethod
+    def get_parser(kind: str, filepath: str, size_factor: int,
+                   load: Callable[[], Any]) -> Any:
+        key = MapCache.cache_key(kind=kind, filepath=filepath)
+        if key in MapCache.entries:
+            MapCache.stats.hits += 1
+            MapCache.entries.move_to_end(key)
+            return MapCache.entries[key].parser
+
+        MapCache.stats.misses += 1
+        stale_keys = [
+            stale_key for stale_key in MapCache.entries
+            if stale_key[:2] == key[:2]
+        ]
+        for stale_key in stale_keys:
+            MapCache.release(MapCache.entries.pop(stale_key))
+
+        parser = load()
+        MapCache.entries[key] = MapCacheEntry(
+            parser=parser, size=os.path.getsize(filepath) * size_factor)
+        MapCache.evict()
+        return parser
+
+    @staticmethod
+    def cache_key(kind: str, filepath: str) -> Tuple[str, str, int, int]:
+        stat = os.stat(filepath)
+        return kind, os.path.realpath(filepath), stat.st_mtime_ns, stat.st_size
+
+    @staticmethod
+    def evict():
+        """
+        Evict the least recently used parsers until the cache fits in memory_budget. The most recently used parser is always kept.
+        """
+        total_size = sum(entry.size for entry in MapCache.entries.values())
+        while total_size > MapCache.memory_budget and len(
+                MapCache.entries) > 1:
+            _, entry = MapCache.entries.popitem(last=False)
+            MapCache.release(entry)
+            total_size -= entry.size
+            MapCache.stats.evictions += 1
+
+    @staticmethod
+    def release(entry: MapCacheEntry):
+        """
+        Unset ApolloMapParser.get_instance if it returns the parser of a removed entry, so the parser can be freed.
+        """
+        if isinstance(entry.parser, ApolloMapParser):
+            entry.parser.unload_instance()
+
+    @staticmethod
+    def share_for_workers(directory: Optional[str] = None):
+        """
+        Prepare the cached maps to be shared read-only with worker processes forked afterwards.
+        - Every derived structure of the Apollo maps and the lanelet indexes, affine projections and routing graphs of the vector maps are built now, so workers never build their own copies, and lane geometry is moved to a memory-mapped buffer (see ApolloMapParser.share_geometry).
+        - The objects are then frozen out of garbage collection, so collections in the workers do not write to the pages holding them.
+        """
+        for entry in MapCache.entries.values():
+            if isinstance(entry.parser, ApolloMapParser):
+                entry.parser.build_all_structures()
+                entry.parser.share_geometry(directory=directory)
+            elif isinstance(entry.parser, VectorMapParser):
+                entry.parser.lanelet_index
+                Geometry.affine_projection(entry.parser)
+                for entity_type in ASTEntityType:
+                    entry.parser.routing_graph(entity_type)
+        gc.collect()
+        gc.freeze()
+
+    @staticmethod
+    def configure(memory_budget: int):
+        MapCache.memory_budget = memory_budget
+        MapCache.evict()
 
     @staticmethod
-    def get_vector_map_parser(vector_map_path: str) -> VectorMapParser:
-        if not MapCache.vector_map_parser:
-            MapCache.vector_map_parser = VectorMapParser(
-                vector_map_path=vector_map_path)
-        return MapCache.vector_map_parser
+    def clear():
+        for entry in MapCache.entries.values():
+            MapCache.release(entry)
+        MapCache.entries.clear()
+        MapCache.stats = MapCacheStats()
@@ -0,0 +1,75 @@
+import os
+import hashlib
+from typing import Dict, List, Optional
+import numpy as np
+
+
+class ObstacleTrackCache:
+    """
+    On-disk cache of decoded PerceptionObstacle samples, stored as columnar arrays in an uncompressed .npz file.
+    - Entries are keyed by the path, size and modification time of every record segment and the schema version, so a record is decoded once regardless of the transformer configuration.
+    """
+    SCHEMA_VERSION = 1
+    COLUMNS = {
+        "id": np.int64,
+        "timestamp": np.float64,
+        "x": np.float64,
+        "y": np.float64,
+        "z": np.float64,
+        "theta": np.float64,
+        "vx": np.float64,
+        "vy": np.float64,
+        "type": np.int32,
+        "length": np.float64,
+        "width": np.float64,
+        "height": np.float64
+    }
+
+    cache_dir: str
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def source_key(source_paths: List[str]) -> str:
+        """
+        Key of the record segments, in the given order.
+        - Only the file stats are read, the same way CyberRecordIndex validates its sidecar, so a cache hit does not scan the record.
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        for source_path in source_paths:
+            stat = os.stat(source_path)
+            digest.update(
+                f"{os.path.realpath(source_path)}\0{stat.st_size}\0{stat.st_mtime_ns}\n"
+                .encode())
+        return digest.hexdigest()
+
+    def cache_path(self, source_key: str) -> str:
+        return os.path.join(
+            self.cache_dir,
+            f"{source_key}-v{ObstacleTrackCache.SCHEMA_VERSION}.npz")
+
+    def load(self, source_key: str) -> Optional[Dict[str, np.ndarray]]:
+        """
+        - return: columns and the "error_code" array of the first PerceptionObstacles message, or None on a cache miss
+        """
+        cache_path = self.cache_path(source_key)
+        if not os.path.exists(cache_path):
+            return None
+
+        try:
+            with np.load(cache_path) as data:
+                return {key: data[key] for key in data.files}
+        except (OSError, ValueError) as ex:
+            print(f"Warning: ignore broken obstacle cache {cache_path}, {ex}")
+            return None
+
+    def save(self, source_key: str, columns: Dict[str, np.ndarray]):
+        cache_path = self.cache_path(source_key)
+        temp_path = f"{cache_path}.{os.getpid()}.tmp.npz"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            np.savez(temp_path, **columns)
+            os.replace(temp_path, cache_path)
+        except OSError as ex:
+            print(f"Warning: cannot write obstacle cache {cache_path}, {ex}")
@@ -1,4 +1,7 @@
-from typing import List, Dict, Type, TypeVar
+import os
+import hashlib
+from collections import OrderedDict
+from typing import List, Dict, Optional, Sequence, Type, TypeVar
 import lanelet2
 from lanelet2.core import Lanelet, LaneletMap, TrafficLight
 from lanelet2.projection import MGRSProjector
@@ -6,44 +9,99 @@ from lanelet2.io import Origin
 from lanelet2.traffic_rules import Locations, Participants
 from lanelet2.routing import RoutingGraph
 from ads_scenario_transformer.builder.entities_builder import ASTEntityType
+from ads_scenario_transformer.tools.lanelet_index import LaneletIndex
+from ads_scenario_transformer.tools.affine_projection import AffineProjection
 
 T = TypeVar('T')
 
 
 class VectorMapParser:
+    """
+    Lanelet2 map with a routing graph per traffic participant
+    - A routing graph is built on the first routing_graph call of its participant, so maps used without pedestrians never build the pedestrian graph.
+    - If map_cache_dir is set, the loaded map is stored in the lanelet2 binary format keyed by the content hash of the OSM file, and later loads of the same file read the binary map instead of parsing the OSM file.
+    """
     lanelet_map: LaneletMap
     projector: MGRSProjector
+    map_cache_dir: Optional[str]
+    routing_graphs: Dict[str, RoutingGraph]  # participant -> routing graph
+    affine_projections: Dict[int, Optional[AffineProjection]]  # UTM zone -> affine projection
+    routes: OrderedDict  # (participant, start id, via ids, end id) -> lanelets of the shortest route, or None if there is no route
+    __lanelet_index: Optional[LaneletIndex]
 
-    def __init__(self, vector_map_path: str):
+    PROJECTION_TOLERANCE = 0.001  # default largest error in meters of the affine projection of UTM coordinates (see Geometry.project_UTM_points), 0 always uses the exact projection
+    ROUTE_CACHE_SIZE = 65536
+
+    PARTICIPANTS = {
+        ASTEntityType.PEDESTRIAN: Participants.Pedestrian,
+        # Bicycle also uses vehicle routing graph
+        ASTEntityType.BICYCLE: Participants.Vehicle
+    }
+
+    def __init__(self,
+                 vector_map_path: str,
+                 map_cache_dir: Optional[str] = None):
         origin = Origin(0.0, 0.0, 0.0)
         self.projector = MGRSProjector(origin)
-        self.lanelet_map = lanelet2.io.load(vector_map_path, self.projector)
+        self.map_cache_dir = map_cache_dir
+        self.lanelet_map = self.load_lanelet_map(vector_map_path)
+        self.routing_graphs = {}
+        self.affine_projections = {}
+        self.routes = OrderedDict()
+        self.__lanelet_index = None
+
+    def load_lanelet_map(self, vector_map_path: str) -> LaneletMap:
+        if not self.map_cache_dir:
+            return lanelet2.io.load(vector_map_path, self.projector)
+
+        cache_path = self.cache_path(vector_map_path)
+        if os.path.exists(cache_path):
+            try:
+                return lanelet2.io.load(cache_path, self.projector)
+            except RuntimeError as ex:
+                print(
+                    f"Warning: ignore broken lanelet map cache {cache_path}, {ex}"
+                )
 
-        self.vehicle_traffic_rules = lanelet2.traffic_rules.create(
-            Locations.Germany, Participants.Vehicle)
-        self.pedestrian_traffic_rules = lanelet2.traffic_rules.create(
-            Locations.Germany, Participants.Pedestrian)
+        lanelet_map = lanelet2.io.load(vector_map_path, self.projector)
+        # the file extension selects the lanelet2 binary format
+        temp_path = f"{cache_path}.{os.getpid()}.tmp.bin"
+        try:
+            os.makedirs(self.map_cache_dir, exist_ok=True)
+            lanelet2.io.write(temp_path, lanelet_map, self.projector)
+            os.replace(temp_path, cache_path)
+        except (OSError, RuntimeError) as ex:
+            print(f"Warning: cannot write lanelet map cache {cache_path}, {ex}")
+        return lanelet_map
 
-        self.vehicle_routing_graph = lanelet2.routing.RoutingGraph(
-            self.lanelet_map, self.vehicle_traffic_rules)
-        self.pedestrian_routing_graph = lanelet2.routing.RoutingGraph(
-            self.lanelet_map, self.pedestrian_traffic_rules)
+    def cache_path(self, vector_map_path: str,
+                   block_size: int = 1 << 20) -> str:
+        digest = hashlib.blake2b(digest_size=20)
+        with open(vector_map_path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                digest.update(block)
+        return os.path.join(self.map_cache_dir, f"{digest.hexdigest()}.bin")
+
+    @property
+    def lanelet_index(self) -> LaneletIndex:
+        if self.__lanelet_index is None:
+            self.__lanelet_index = LaneletIndex(self.lanelet_map)
+        return self.__lanelet_index
 
     def get_attributes(self, key: str,
                        attribute_type: Type[T]) -> Dict[int, T]:
         """
         - attribute_key: ['location', 'one_way', 'participant:vehicle', 'speed_limit', 'subtype', 'turn_direction', 'type']
         """
-        result = {}
-        for lanelet in self.lanelet_map.laneletLayer:
-            if key in lanelet.attributes:
-                result[lanelet.id] = attribute_type(lanelet.attributes[key])
-        return result
+        return {
+            id: attribute_type(value)
+            for id, value in self.lanelet_index.attributes.get(key, {}).items()
+        }
 
     def get_lanelets(self, identifiers: List[int]) -> List[Lanelet]:
+        lanelets = self.lanelet_index.lanelets
         return [
-            lanelet for lanelet in self.lanelet_map.laneletLayer
-            if lanelet.id in identifiers
+            lanelets[id] for id in dict.fromkeys(identifiers) if id in lanelets
         ]
 
     def get_all_intersections(self) -> Dict[int, str]:
@@ -61,11 +119,49 @@ class VectorMapParser:
     def regualtory_element_layer(self):
         return self.lanelet_map.regulatoryElementLayer
 
+    @staticmethod
+    def participant(type: ASTEntityType) -> str:
+        return VectorMapParser.PARTICIPANTS.get(type, Participants.Vehicle)
+
     def routing_graph(self, type: ASTEntityType) -> RoutingGraph:
-        if type == ASTEntityType.PEDESTRIAN:
-            return self.pedestrian_routing_graph
-        elif type == ASTEntityType.BICYCLE:
-            # Bicycle also uses vehicle routing graph
-            return self.vehicle_routing_graph
-        # ego, car
-        return self.vehicle_routing_graph
+        """
+        - type: ego and car use the vehicle routing graph
+        """
+        participant = VectorMapParser.participant(type)
+        if participant not in self.routing_graphs:
+            traffic_rules = lanelet2.traffic_rules.create(
+                Locations.Germany, participant)
+            self.routing_graphs[participant] = RoutingGraph(
+                self.lanelet_map, traffic_rules)
+        return self.routing_graphs[participant]
+
+    def shortest_path(self,
+                      type: ASTEntityType,
+                      start_lanelet: Lanelet,
+                      end_lanelet: Lanelet,
+                      via_lanelets: Sequence[Lanelet] = ()) -> Optional[List[Lanelet]]:
+        """
+        Lanelets of the shortest route from start_lanelet to end_lanelet through via_lanelets, with lane changes
+        - Routes are kept in a LRU cache keyed on the routing graph and the lanelet ids, since all points of a track query the same routes.
+        - return: None if there is no route
+        """
+        key = (VectorMapParser.participant(type), start_lanelet.id,
+               tuple(lanelet.id for lanelet in via_lanelets), end_lanelet.id)
+        if key in self.routes:
+            self.routes.move_to_end(key)
+            return self.routes[key]
+
+        routing_graph = self.routing_graph(type)
+        if via_lanelets:
+            route = routing_graph.getRouteVia(start_lanelet,
+                                              list(via_lanelets), end_lanelet,
+                                              0, True)
+        else:
+            route = routing_graph.getRoute(start_lanelet, end_lanelet, 0,
+                                           True)
+        path = list(route.shortestPath()) if route else None
+
+        self.routes[key] = path
+        if len(self.routes) > VectorMapParser.ROUTE_CACHE_SIZE:
+            self.routes.popitem(last=False)
+        return path
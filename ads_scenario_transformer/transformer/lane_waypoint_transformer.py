@@ -16,6 +16,8 @@ class LaneWaypointTransformerConfiguration:
     scenario_object: ScenarioObject
     apollo_map_parser: ApolloMapParser
     reference_points: Optional[Tuple[PointENU, PointENU]]
+    projection_tolerance: Optional[
+        float] = VectorMapParser.PROJECTION_TOLERANCE  # see Geometry.project_UTM_points
 
 
 class LaneWaypointTransformer(Transformer):
@@ -40,7 +42,8 @@ class LaneWaypointTransformer(Transformer):
                 supported_position=PointENUTransformer.SupportedPosition.Lane,
                 vector_map_parser=self.configuration.vector_map_parser,
                 scenario_object=self.configuration.scenario_object,
-                reference_points=self.configuration.reference_points))
+                reference_points=self.configuration.reference_points,
+                projection_tolerance=self.configuration.projection_tolerance))
         position = pointenu_transformer.transform(
             PointENUTransformerInput(point=pose, heading=heading))
 
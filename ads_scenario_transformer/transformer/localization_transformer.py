@@ -15,6 +15,8 @@ class LocalizationTransformerConfiguration:
     vector_map_parser: VectorMapParser
     apollo_map_parser: ApolloMapParser
     ego_scenario_object: ScenarioObject
+    projection_tolerance: Optional[
+        float] = VectorMapParser.PROJECTION_TOLERANCE  # see Geometry.project_UTM_points
 
 
 class LocalizationTransformer(Transformer):
@@ -57,7 +59,8 @@ class LocalizationTransformer(Transformer):
                 supported_position=PointENUTransformer.SupportedPosition.Lane,
                 vector_map_parser=self.configuration.vector_map_parser,
                 scenario_object=self.configuration.ego_scenario_object,
-                reference_points=[start_point, end_point]))
+                reference_points=[start_point, end_point],
+                projection_tolerance=self.configuration.projection_tolerance))
 
         position = transformer.transform(
             source=PointENUTransformerInput(point, 0.0))
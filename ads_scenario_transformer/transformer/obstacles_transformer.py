@@ -1,7 +1,10 @@
 import math
+from array import array
+from collections.abc import Sequence
 from dataclasses import dataclass
-from typing import List, Optional, Dict, Tuple, Set
-from lanelet2.core import LaneletMap
+from typing import List, Optional, Dict, Tuple, Set, Iterable, NamedTuple
+import numpy as np
+from lanelet2.core import LaneletMap, BasicPoint3d
 from lanelet2.projection import MGRSProjector
 from modules.perception.proto.perception_obstacle_pb2 import PerceptionObstacles, PerceptionObstacle
 from modules.common.proto.geometry_pb2 import PointENU, Point3D
@@ -21,6 +24,8 @@ from ads_scenario_transformer.builder.storyboard.condition_builder import Condit
 from ads_scenario_transformer.builder.storyboard.trigger_builder import StartTriggerBuilder
 from ads_scenario_transformer.builder.entities_builder import EntitiesBuilder, ASTEntity, ASTEntityType
 from ads_scenario_transformer.tools.vector_map_parser import VectorMapParser
+from ads_scenario_transformer.tools.obstacle_track_cache import ObstacleTrackCache
+from ads_scenario_transformer.tools.geometry import Geometry, LaneCorridor
 
 
 @dataclass
@@ -30,6 +35,8 @@ class ObstaclesTransformerConfiguration:
     waypoint_frequency_in_sec: Optional[
         float]  # None = direction detection, 0 = all waypoints, others = input frequency, Average frequency of the PerceptionObstacles channel is 0.04s to 0.05s. If you set lower than 0.04s, the obstacles will add all waypoints.
     direction_change_detection_threshold: float = 60
+    projection_tolerance: Optional[
+        float] = VectorMapParser.PROJECTION_TOLERANCE  # see Geometry.project_UTM_points
 
 
 @dataclass
@@ -38,24 +45,178 @@ class ObstaclesTransformerResult:
     stories: List[Story]
 
 
+class Vector3(NamedTuple):
+    x: float
+    y: float
+    z: float = 0.0
+
+
+class ObstacleSample(NamedTuple):
+    """
+    The fields of a PerceptionObstacle that the transformers read
+    """
+    id: int
+    timestamp: float
+    position: Vector3
+    theta: float
+    velocity: Vector3
+    type: int
+    length: float
+    width: float
+    height: float
+
+
+class ObstacleTrack(Sequence):
+    """
+    Samples of one obstacle, stored as one typed array per column of ObstacleTrackCache.COLUMNS.
+    - A sample costs a few machine words per column instead of a PerceptionObstacle message.
+    - Indexing returns an ObstacleSample made on access, so no object is kept per sample.
+    """
+    TYPECODES = {np.int32: "i", np.int64: "q", np.float64: "d"}
+
+    id: int
+    columns: Dict[str, array]
+
+    def __init__(self, id: int):
+        self.id = id
+        self.columns = {
+            key: array(ObstacleTrack.TYPECODES[dtype])
+            for key, dtype in ObstacleTrackCache.COLUMNS.items()
+            if key != "id"
+        }
+
+    def append(self, obstacle: PerceptionObstacle):
+        columns = self.columns
+        columns["timestamp"].append(obstacle.timestamp)
+        columns["x"].append(obstacle.position.x)
+        columns["y"].append(obstacle.position.y)
+        columns["z"].append(obstacle.position.z)
+        columns["theta"].append(obstacle.theta)
+        columns["vx"].append(obstacle.velocity.x)
+        columns["vy"].append(obstacle.velocity.y)
+        columns["type"].append(obstacle.type)
+        columns["length"].append(obstacle.length)
+        columns["width"].append(obstacle.width)
+        columns["height"].append(obstacle.height)
+
+    def extend(self, columns: Dict[str, np.ndarray]):
+        """
+        - columns: arrays of the same length for every column except "id"
+        """
+        for key, values in self.columns.items():
+            values.frombytes(
+                np.ascontiguousarray(
+                    columns[key],
+                    dtype=ObstacleTrackCache.COLUMNS[key]).tobytes())
+
+    def __len__(self) -> int:
+        return len(self.columns["timestamp"])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        columns = self.columns
+        return ObstacleSample(id=self.id,
+                              timestamp=columns["timestamp"][index],
+                              position=Vector3(x=columns["x"][index],
+                                               y=columns["y"][index],
+                                               z=columns["z"][index]),
+                              theta=columns["theta"][index],
+                              velocity=Vector3(x=columns["vx"][index],
+                                               y=columns["vy"][index]),
+                              type=columns["type"][index],
+                              length=columns["length"][index],
+                              width=columns["width"][index],
+                              height=columns["height"][index])
+
+
+class ObstacleTracks:
+    """
+    PerceptionObstacle samples grouped by obstacle id. It is filled one PerceptionObstacles message at a time, so the channel can be streamed instead of being kept in memory.
+    - Only the fields read by the transformers are kept, as columns of an ObstacleTrack per obstacle.
+    """
+    error_code: Optional[int]
+    tracks: Dict[int, ObstacleTrack]
+
+    def __init__(self):
+        self.error_code = None
+        self.tracks = {}
+
+    def add(self, perception_obstacles: PerceptionObstacles):
+        if self.error_code is None:
+            self.error_code = perception_obstacles.error_code
+
+        for obstacle in perception_obstacles.perception_obstacle:
+            if obstacle.id not in self.tracks:
+                self.tracks[obstacle.id] = ObstacleTrack(id=obstacle.id)
+            self.tracks[obstacle.id].append(obstacle)
+
+    def to_columns(self) -> Dict[str, np.ndarray]:
+        """
+        Concatenate the tracks into the columnar layout of ObstacleTrackCache.
+        """
+        tracks = list(self.tracks.values())
+        columns = {
+            "id":
+            np.repeat(
+                np.array([track.id for track in tracks],
+                         dtype=ObstacleTrackCache.COLUMNS["id"]),
+                [len(track) for track in tracks])
+        }
+        for key, dtype in ObstacleTrackCache.COLUMNS.items():
+            if key == "id":
+                continue
+            columns[key] = np.concatenate([
+                np.frombuffer(track.columns[key], dtype=dtype)
+                for track in tracks
+            ] + [np.array([], dtype=dtype)])
+        columns["error_code"] = np.array(
+            [] if self.error_code is None else [self.error_code],
+            dtype=np.int32)
+        return columns
+
+    @staticmethod
+    def from_columns(columns: Dict[str, np.ndarray]) -> 'ObstacleTracks':
+        obstacle_tracks = ObstacleTracks()
+        if len(columns["error_code"]):
+            obstacle_tracks.error_code = int(columns["error_code"][0])
+
+        ids = columns["id"]
+        unique_ids, first_indices = np.unique(ids, return_index=True)
+        # tracks in the order their obstacle first appears, samples in record order
+        for id in unique_ids[np.argsort(first_indices)].tolist():
+            rows = ids == id
+            track = ObstacleTrack(id=id)
+            track.extend(
+                {key: columns[key][rows]
+                 for key in track.columns})
+            obstacle_tracks.tracks[id] = track
+        return obstacle_tracks
+
+
 class ObstaclesTransformer(Transformer):
     configuration: ObstaclesTransformerConfiguration
 
-    Source = List[PerceptionObstacles]
+    Source = Iterable[PerceptionObstacles]
     Target = ObstaclesTransformerResult
 
     def __init__(self, configuration: ObstaclesTransformerConfiguration):
         self.configuration = configuration
 
-    def transform(
+    def transform(self, source: Source) -> ObstaclesTransformerResult:
+        return self.transform_tracks(
+            obstacle_tracks=self.group_obstacles(obstacles=source))
+
+    def transform_tracks(
             self,
-            source: List[PerceptionObstacles]) -> ObstaclesTransformerResult:
+            obstacle_tracks: ObstacleTracks) -> ObstaclesTransformerResult:
 
-        if source[0].error_code:
+        if obstacle_tracks.error_code:
             return ObstaclesTransformerResult(entities_with_id=[], stories=[])
 
-        entities_with_id = self.get_obstacles(source)
-        grouped_obstacles = self.group_obstacles(obstacles=source)
+        entities_with_id = self.get_obstacles(obstacle_tracks)
+        grouped_obstacles = obstacle_tracks.tracks
 
         stories = []
         for id, obstacles in grouped_obstacles.items():
@@ -67,11 +228,14 @@ class ObstaclesTransformer(Transformer):
                 continue
 
             start = obstacles[0]
+            lane_corridor = self.lane_corridor(obstacles=obstacles,
+                                               scenario_object=target_object)
             start_position = self.transform_coordinate_value(
                 position=start.position,
                 scenario_object=target_object,
                 start_point=obstacles[0].position,
-                end_point=obstacles[-1].position)
+                end_point=obstacles[-1].position,
+                lane_corridor=lane_corridor)
 
             if not start_position:
                 raise ValueError(
@@ -103,7 +267,8 @@ class ObstaclesTransformer(Transformer):
                         position=obstacles[idx].position,
                         scenario_object=target_object,
                         start_point=obstacles[0].position,
-                        end_point=obstacles[-1].position)
+                        end_point=obstacles[-1].position,
+                        lane_corridor=lane_corridor)
                     if position:
                         routing_positions.append(position)
                     else:
@@ -135,30 +300,29 @@ class ObstaclesTransformer(Transformer):
     # helper functions
 
     def get_obstacles(
-        self, obstacles: List[PerceptionObstacles]
+        self, obstacle_tracks: ObstacleTracks
     ) -> List[Tuple[ASTEntity, ScenarioObject]]:
 
         uniq_obstacles = {}
-        for obstacle in obstacles:
-            for ob in obstacle.perception_obstacle:
-                if ob.id not in uniq_obstacles:
-                    entity_type = None
-                    if ob.type == 3:
-                        entity_type = ASTEntityType.PEDESTRIAN
-                    elif ob.type == 4:
-                        entity_type = ASTEntityType.BICYCLE
-                    elif ob.type == 5:
-                        entity_type = ASTEntityType.CAR
-                    else:
-                        continue
+        for id, obstacles in obstacle_tracks.tracks.items():
+            ob = obstacles[0]
+            entity_type = None
+            if ob.type == 3:
+                entity_type = ASTEntityType.PEDESTRIAN
+            elif ob.type == 4:
+                entity_type = ASTEntityType.BICYCLE
+            elif ob.type == 5:
+                entity_type = ASTEntityType.CAR
+            else:
+                continue
 
-                    ast_entity = ASTEntity(entity_type=entity_type,
-                                           use_default_scenario_object=False,
-                                           embedding_id=ob.id,
-                                           length=ob.length,
-                                           height=ob.height,
-                                           width=ob.width)
-                    uniq_obstacles[ob.id] = ast_entity
+            ast_entity = ASTEntity(entity_type=entity_type,
+                                   use_default_scenario_object=False,
+                                   embedding_id=ob.id,
+                                   length=ob.length,
+                                   height=ob.height,
+                                   width=ob.width)
+            uniq_obstacles[ob.id] = ast_entity
 
         entities_builder = EntitiesBuilder()
         for id, ast_entity in uniq_obstacles.items():
@@ -192,7 +356,7 @@ class ObstaclesTransformer(Transformer):
         return event_builder.get_result()
 
     def create_speed_act(self, target_object: ScenarioObject,
-                         obstacles: List[PerceptionObstacles]) -> Act:
+                         obstacles: ObstacleTrack) -> Act:
         speed_transformer = SpeedTransformer(
             configuration=SpeedTransformerConfiguration(
                 entity_name=target_object.name))
@@ -222,7 +386,7 @@ class ObstaclesTransformer(Transformer):
         return act_builder.get_result()
 
     def is_obstacle_routable(self,
-                             obstacles: List[PerceptionObstacle]) -> bool:
+                             obstacles: ObstacleTrack) -> bool:
         if obstacles[0].type != 3:
             return True
 
@@ -234,23 +398,18 @@ class ObstaclesTransformer(Transformer):
                 return False
         return True
 
-    def is_obstacle_moved(self, obstacles: List[PerceptionObstacle]) -> bool:
+    def is_obstacle_moved(self, obstacles: ObstacleTrack) -> bool:
         return self.max_velocity_meter_per_sec(obstacles=obstacles) != 0.0
 
     def group_obstacles(
-        self, obstacles: List[PerceptionObstacles]
-    ) -> Dict[str, List[PerceptionObstacles]]:
-        grouped_obstacles = {}
+            self, obstacles: Iterable[PerceptionObstacles]) -> ObstacleTracks:
+        obstacle_tracks = ObstacleTracks()
         for perception_obstacles in obstacles:
-            for obstacle in perception_obstacles.perception_obstacle:
-
-                if obstacle.id not in grouped_obstacles:
-                    grouped_obstacles[obstacle.id] = []
-                grouped_obstacles[obstacle.id].append(obstacle)
-        return grouped_obstacles
+            obstacle_tracks.add(perception_obstacles)
+        return obstacle_tracks
 
     def obstacle_start_moving_idx(self,
-                                  obstacles: List[PerceptionObstacle]) -> int:
+                                  obstacles: ObstacleTrack) -> int:
         obstacle_start_moving_idx = 0
         for i, obstacle in enumerate(obstacles):
             velocity = self.calculate_velocity_meter_per_sec(obstacle.velocity)
@@ -261,7 +420,7 @@ class ObstaclesTransformer(Transformer):
         return obstacle_start_moving_idx
 
     def obstacle_end_moving_idx(self,
-                                obstacles: List[PerceptionObstacle]) -> int:
+                                obstacles: ObstacleTrack) -> int:
         obstacle_end_moving_idx = len(obstacles) - 1
         for i, obstacle in enumerate(reversed(obstacles)):
             velocity = self.calculate_velocity_meter_per_sec(obstacle.velocity)
@@ -272,7 +431,7 @@ class ObstaclesTransformer(Transformer):
         return obstacle_end_moving_idx
 
     def obstacle_start_moving_time(
-            self, obstacles: List[PerceptionObstacle]) -> float:
+            self, obstacles: ObstacleTrack) -> float:
         obstacle_start_moving_idx = self.obstacle_start_moving_idx(obstacles)
 
         return max(
@@ -280,7 +439,7 @@ class ObstaclesTransformer(Transformer):
             self.configuration.sceanrio_start_timestamp, 0)
 
     def obstacle_routing_indices(
-            self, obstacles: List[PerceptionObstacle]) -> List[int]:
+            self, obstacles: ObstacleTrack) -> List[int]:
         frequency = self.configuration.waypoint_frequency_in_sec
 
         result = []
@@ -309,7 +468,7 @@ class ObstaclesTransformer(Transformer):
         return angle % (2 * math.pi)
 
     def obstacle_direction_changed_indices(
-            self, obstacles: List[PerceptionObstacle]) -> List[int]:
+            self, obstacles: ObstacleTrack) -> List[int]:
         assert 0 <= self.configuration.direction_change_detection_threshold <= 360
 
         routing_indices = []
@@ -331,7 +490,7 @@ class ObstaclesTransformer(Transformer):
         return math.sqrt(x**2 + y**2)
 
     def max_velocity_meter_per_sec(
-            self, obstacles: List[PerceptionObstacle]) -> float:
+            self, obstacles: ObstacleTrack) -> float:
         return max([
             self.calculate_velocity_meter_per_sec(obstacle.velocity)
             for obstacle in obstacles
@@ -346,10 +505,33 @@ class ObstaclesTransformer(Transformer):
                 return scenario_object
         return None
 
-    def transform_coordinate_value(self, position: Point3D,
-                                   scenario_object: ScenarioObject,
-                                   start_point: Point3D,
-                                   end_point: Point3D) -> Optional[Position]:
+    def lane_corridor(self, obstacles: ObstacleTrack,
+                      scenario_object: ScenarioObject) -> LaneCorridor:
+        """
+        Corridor between the first and the last position of an obstacle, shared by all of its positions
+        """
+        vector_map_parser = self.configuration.vector_map_parser
+        start_point, end_point = [
+            BasicPoint3d(x, y, z) for x, y, z in Geometry.project_UTM_points(
+                vector_map_parser=vector_map_parser,
+                points=Geometry.to_array(
+                    [obstacles[0].position, obstacles[-1].position]),
+                projection_tolerance=self.configuration.projection_tolerance)
+        ]
+        return LaneCorridor(
+            vector_map_parser=vector_map_parser,
+            start_point=start_point,
+            end_point=end_point,
+            entity_type=ASTEntityType.entity_type(scenario_object))
+
+    def transform_coordinate_value(
+            self,
+            position: Point3D,
+            scenario_object: ScenarioObject,
+            start_point: Point3D,
+            end_point: Point3D,
+            lane_corridor: Optional[LaneCorridor] = None
+    ) -> Optional[Position]:
 
         point = PointENU(x=position.x, y=position.y, z=0)
         transformer = PointENUTransformer(
@@ -361,7 +543,9 @@ class ObstaclesTransformer(Transformer):
                     PointENU(x=start_point.x, y=start_point.y,
                              z=start_point.z),
                     PointENU(x=end_point.x, y=end_point.y, z=end_point.z)
-                ]))
+                ],
+                lane_corridor=lane_corridor,
+                projection_tolerance=self.configuration.projection_tolerance))
 
         position = transformer.transform(
             source=PointENUTransformerInput(point, 0.0))
@@ -1,10 +1,11 @@
 from typing import Tuple, Optional
 from enum import Enum
 from dataclasses import dataclass
+from lanelet2.core import BasicPoint3d
 from modules.common.proto.geometry_pb2 import PointENU
 from openscenario_msgs import Position, LanePosition, WorldPosition, ScenarioObject, BoundingBox, Vehicle
 from ads_scenario_transformer.transformer import Transformer
-from ads_scenario_transformer.tools.geometry import Geometry
+from ads_scenario_transformer.tools.geometry import Geometry, LaneCorridor
 from ads_scenario_transformer.tools.vector_map_parser import VectorMapParser
 from ads_scenario_transformer.builder.entities_builder import ASTEntityType
 from ads_scenario_transformer.tools.error import LaneFindingError
@@ -16,6 +17,10 @@ class PointENUTransformerConfiguration:
     vector_map_parser: VectorMapParser
     scenario_object: ScenarioObject
     reference_points: Optional[Tuple[PointENU, PointENU]]
+    lane_corridor: Optional[
+        LaneCorridor] = None  # corridor between reference_points, shared by all points of a trajectory. If None, it is made from reference_points.
+    projection_tolerance: Optional[
+        float] = VectorMapParser.PROJECTION_TOLERANCE  # see Geometry.project_UTM_points
 
 
 @dataclass
@@ -51,38 +56,45 @@ class PointENUTransformer(Transformer):
     def transformToLanePosition(self,
                                 source: Source) -> Optional[LanePosition]:
         vector_map_parser = self.configuration.vector_map_parser
-        lanelet_map = vector_map_parser.lanelet_map
-        projector = vector_map_parser.projector
         entity_type = ASTEntityType.entity_type(
             self.configuration.scenario_object)
 
-        projected_point = Geometry.project_UTM_point_on_lanelet(
-            projector=projector, point=source.point)
+        lane_corridor = self.configuration.lane_corridor
+        points = [source.point]
+        if self.configuration.reference_points and not lane_corridor:
+            points += [
+                self.configuration.reference_points[0],
+                self.configuration.reference_points[-1]
+            ]
+        projected_points = [
+            BasicPoint3d(x, y, z)
+            for x, y, z in Geometry.project_UTM_points(
+                vector_map_parser=vector_map_parser,
+                points=Geometry.to_array(points),
+                projection_tolerance=self.configuration.projection_tolerance)
+        ]
+        projected_point = projected_points[0]
 
-        lanelets = Geometry.find_close_lanelets(map=lanelet_map,
-                                                basic_point=projected_point,
-                                                entity_type=entity_type)
+        lanelets = Geometry.find_close_lanelets(
+            lanelet_index=vector_map_parser.lanelet_index,
+            basic_point=projected_point,
+            entity_type=entity_type)
 
         target_lanelet = None
         if self.configuration.reference_points:
-            start_point = Geometry.project_UTM_point_on_lanelet(
-                projector=projector,
-                point=self.configuration.reference_points[0])
-            end_point = Geometry.project_UTM_point_on_lanelet(
-                projector=projector,
-                point=self.configuration.reference_points[-1])
-
-            available_lanelets = Geometry.find_available_lanes(
-                vector_map_parser=vector_map_parser,
-                start_point=start_point,
-                end_point=end_point,
-                target_point=projected_point,
-                entity_type=entity_type)
+            if not lane_corridor:
+                start_point, end_point = projected_points[1:]
+                lane_corridor = LaneCorridor(
+                    vector_map_parser=vector_map_parser,
+                    start_point=start_point,
+                    end_point=end_point,
+                    entity_type=entity_type)
 
-            available_lane_id = [lanelet.id for lanelet in available_lanelets]
+            available_lanelets = lane_corridor.available_lanelets(
+                target_lanelets=lanelets)
 
             for lanelet in lanelets:
-                if lanelet.id in available_lane_id:
+                if lanelet.id in available_lanelets:
                     target_lanelet = lanelet
                     break
 
@@ -97,7 +109,7 @@ class PointENUTransformer(Transformer):
             self.configuration.scenario_object)
         # Discard heading value
         lane_position = Geometry.nearest_lane_position(
-            map=lanelet_map,
+            lanelet_index=vector_map_parser.lanelet_index,
             lanelet=target_lanelet,
             basic_point=projected_point,
             entity_bounding_box=bounding_box,
@@ -105,14 +117,12 @@ class PointENUTransformer(Transformer):
         return lane_position
 
     def transformToWorldPosition(self, source: Source) -> WorldPosition:
-        projected_point = Geometry.project_UTM_point_on_lanelet(
-            projector=self.configuration.vector_map_parser.projector,
-            point=source.point)
+        x, y, z = Geometry.project_UTM_points(
+            vector_map_parser=self.configuration.vector_map_parser,
+            points=Geometry.to_array([source.point]),
+            projection_tolerance=self.configuration.projection_tolerance)[0]
         # Discard heading value
-        return WorldPosition(x=projected_point.x,
-                             y=projected_point.y,
-                             z=projected_point.z,
-                             h=0.0)
+        return WorldPosition(x=x, y=y, z=z, h=0.0)
 
     def object_bouding_box(
             self, scenario_object: ScenarioObject) -> Optional[BoundingBox]:
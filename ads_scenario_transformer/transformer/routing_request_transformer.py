@@ -16,6 +16,8 @@ class RoutingRequestTransformerConfiguration:
     apollo_map_parser: ApolloMapParser
     ego_scenario_object: ScenarioObject
     reference_points: Optional[Tuple[PointENU, PointENU]]
+    projection_tolerance: Optional[
+        float] = VectorMapParser.PROJECTION_TOLERANCE  # see Geometry.project_UTM_points
 
 
 class RoutingRequestTransformer(Transformer):
@@ -35,7 +37,8 @@ class RoutingRequestTransformer(Transformer):
                 vector_map_parser=self.configuration.vector_map_parser,
                 apollo_map_parser=self.configuration.apollo_map_parser,
                 scenario_object=self.configuration.ego_scenario_object,
-                reference_points=self.configuration.reference_points))
+                reference_points=self.configuration.reference_points,
+                projection_tolerance=self.configuration.projection_tolerance))
 
         openscenario_waypoints = map(
             lambda lane_waypoint:
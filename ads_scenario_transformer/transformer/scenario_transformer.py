@@ -1,10 +1,8 @@
 import math
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from dataclasses import dataclass
 from modules.localization.proto.localization_pb2 import LocalizationEstimate
-from modules.perception.proto.traffic_light_detection_pb2 import TrafficLightDetection
 from modules.routing.proto.routing_pb2 import RoutingRequest
-from modules.perception.proto.perception_obstacle_pb2 import PerceptionObstacles
 from openscenario_msgs import Private, ScenarioObject, Scenario, Entities, Story, RoutingAction
 from ads_scenario_transformer.builder import EntitiesBuilder
 from ads_scenario_transformer.builder.entities_builder import ASTEntityType, ASTEntity
@@ -15,15 +13,16 @@ from ads_scenario_transformer.tools.vector_map_parser import VectorMapParser
 from ads_scenario_transformer.transformer.pointenu_transformer import PointENUTransformer, PointENUTransformerConfiguration, PointENUTransformerInput
 from ads_scenario_transformer.transformer.routing_request_transformer import RoutingRequestTransformerConfiguration
 from ads_scenario_transformer.transformer.localization_transformer import LocalizationTransformer, LocalizationTransformerConfiguration
-from ads_scenario_transformer.transformer.obstacles_transformer import ObstaclesTransformer, ObstaclesTransformerConfiguration, ObstaclesTransformerResult
+from ads_scenario_transformer.transformer.obstacles_transformer import ObstaclesTransformer, ObstaclesTransformerConfiguration, ObstaclesTransformerResult, ObstacleTracks
 from ads_scenario_transformer.builder.scenario_builder import ScenarioBuilder, ScenarioConfiguration
 from ads_scenario_transformer.builder.storyboard.init_builder import InitBuilder
 from ads_scenario_transformer.builder.storyboard.storyboard_builder import StoryboardBuilder
 from ads_scenario_transformer.builder.storyboard.story_builder import StoryBuilder
 from ads_scenario_transformer.builder.storyboard.trigger_builder import StopTriggerBuilder
-from ads_scenario_transformer.transformer.traffic_signal_transformer import TrafficSignalTransformer, TrafficSignalTransformerConfiguration, TrafficSignalTransformerResult
+from ads_scenario_transformer.transformer.traffic_signal_transformer import TrafficSignalTransformer, TrafficSignalTransformerConfiguration, TrafficSignalTransformerResult, TrafficSignalStates
 from ads_scenario_transformer.tools.error import InvalidScenarioInputError
 from ads_scenario_transformer.tools.map_cache import MapCache
+from ads_scenario_transformer.tools.obstacle_track_cache import ObstacleTrackCache
 
 
 @dataclass
@@ -38,6 +37,12 @@ class ScenarioTransformerConfiguration:
     disable_traffic_signal: bool
     use_last_position_as_destination: bool  # if True, the destination is the last position of the ego in LocalizationPose chanel, otherwise, the ego destination becomes the last position in routing request
     add_violation_detecting_conditions: bool
+    obstacle_cache_dir: Optional[str]  # if set, decoded obstacle tracks are cached in this directory by record content hash
+    vector_map_cache_dir: Optional[str]  # if set, the vector map is cached in this directory in the lanelet2 binary format
+    projection_tolerance: Optional[float]  # UTM coordinates are projected on the vector map with an affine fit of the map if its measured error is below this tolerance (in meters), 0 always uses the exact projection
+    record_workers: int  # number of processes decompressing record chunks, 1 reads the record in this process
+    record_start_time: Optional[float]  # if set, only the part of the record from this time (in seconds) is transformed
+    record_end_time: Optional[float]  # if set, only the part of the record until this time (in seconds) is transformed
 
     def __init__(self,
                  apollo_scenario_path: str,
@@ -49,7 +54,14 @@ class ScenarioTransformerConfiguration:
                  disable_traffic_signal: bool = False,
                  obstacle_direction_change_detection_threshold=60,
                  road_network_lanelet_map_path: Optional[str] = None,
-                 road_network_pcd_map_path: str = "point_cloud.pcd"):
+                 road_network_pcd_map_path: str = "point_cloud.pcd",
+                 obstacle_cache_dir: Optional[str] = None,
+                 vector_map_cache_dir: Optional[str] = None,
+                 projection_tolerance: Optional[
+                     float] = VectorMapParser.PROJECTION_TOLERANCE,
+                 record_workers: int = 1,
+                 record_start_time: Optional[float] = None,
+                 record_end_time: Optional[float] = None):
         self.apollo_scenario_path = apollo_scenario_path
         self.apollo_hd_map_path = apollo_hd_map_path
         self.vector_map_path = vector_map_path
@@ -63,6 +75,22 @@ class ScenarioTransformerConfiguration:
             self.road_network_lanelet_map_path = vector_map_path
         self.road_network_pcd_map_path = road_network_pcd_map_path
         self.add_violation_detecting_conditions = add_violation_detecting_conditions
+        self.obstacle_cache_dir = obstacle_cache_dir
+        self.vector_map_cache_dir = vector_map_cache_dir
+        self.projection_tolerance = projection_tolerance
+        self.record_workers = record_workers
+        self.record_start_time = record_start_time
+        self.record_end_time = record_end_time
+
+    def record_time_window(self) -> Tuple[Optional[int], Optional[int]]:
+        """
+        - return: record_start_time and record_end_time in nanoseconds, the time unit of cyber records
+        """
+        start_time = None if self.record_start_time is None else int(
+            self.record_start_time * 1e9)
+        end_time = None if self.record_end_time is None else int(
+            self.record_end_time * 1e9)
+        return start_time, end_time
 
 
 class ScenarioTransformer:
@@ -71,8 +99,9 @@ class ScenarioTransformer:
     entities: Entities
     localization_poses: List[LocalizationEstimate]
     routing_request: Optional[RoutingRequest]
-    obstacles: Optional[PerceptionObstacles]
-    traffic_light_detections: List[TrafficLightDetection]
+    obstacle_tracks: ObstacleTracks
+    traffic_signal_states: TrafficSignalStates
+    channels_read: bool
 
     def __init__(self, configuration: ScenarioTransformerConfiguration):
         self.configuration = configuration
@@ -80,12 +109,14 @@ class ScenarioTransformer:
         self.apollo_map_parser = MapCache.get_apollo_map_parser(
             apollo_hd_map_path=configuration.apollo_hd_map_path)
         self.vector_map_parser = MapCache.get_vector_map_parser(
-            vector_map_path=configuration.vector_map_path)
+            vector_map_path=configuration.vector_map_path,
+            map_cache_dir=configuration.vector_map_cache_dir)
 
         self.localization_poses = []
         self.routing_request = None
-        self.obstacles = []
-        self.traffic_light_detections = []
+        self.obstacle_tracks = ObstacleTracks()
+        self.traffic_signal_states = TrafficSignalStates()
+        self.channels_read = False
         self.input_localization()
 
     def transform(self) -> Scenario:
@@ -151,7 +182,9 @@ class ScenarioTransformer:
                     Lane,
                     vector_map_parser=self.vector_map_parser,
                     scenario_object=self.entities.scenarioObjects[0],
-                    reference_points=[start_pose, end_pose]))
+                    reference_points=[start_pose, end_pose],
+                    projection_tolerance=self.configuration.
+                    projection_tolerance))
             ego_end_position = pointenu_transformer.transform(
                 PointENUTransformerInput(end_pose, 0.0))
         else:
@@ -182,9 +215,11 @@ class ScenarioTransformer:
                 waypoint_frequency_in_sec=self.configuration.
                 obstacle_waypoint_frequency_in_sec,
                 direction_change_detection_threshold=self.configuration.
-                obstacle_direction_change_detection_threshold))
+                obstacle_direction_change_detection_threshold,
+                projection_tolerance=self.configuration.projection_tolerance))
 
-        return obstacles_transformer.transform(source=obstacles)
+        return obstacles_transformer.transform_tracks(
+            obstacle_tracks=obstacles)
 
     def transform_ego_routing(self,
                               ego_scenario_object: ScenarioObject) -> Private:
@@ -197,7 +232,9 @@ class ScenarioTransformer:
                 configuration=LocalizationTransformerConfiguration(
                     vector_map_parser=self.vector_map_parser,
                     apollo_map_parser=self.apollo_map_parser,
-                    ego_scenario_object=ego_scenario_object))
+                    ego_scenario_object=ego_scenario_object,
+                    projection_tolerance=self.configuration.
+                    projection_tolerance))
             return localization_transformer.transform(self.localization_poses)
 
         routing_request_transformer = RoutingRequestTransformer(
@@ -205,7 +242,8 @@ class ScenarioTransformer:
                 vector_map_parser=self.vector_map_parser,
                 apollo_map_parser=self.apollo_map_parser,
                 ego_scenario_object=ego_scenario_object,
-                reference_points=[start_point, end_point]))
+                reference_points=[start_point, end_point],
+                projection_tolerance=self.configuration.projection_tolerance))
         routing_request = self.input_routing_request()
 
         return routing_request_transformer.transform(routing_request)
@@ -216,73 +254,117 @@ class ScenarioTransformer:
                 vector_map_parser=self.vector_map_parser,
                 apollo_map_parser=self.apollo_map_parser))
 
-        traffic_light_detections = self.input_traffic_light_detections()
-        return traffic_signal_transformer.transform(traffic_light_detections)
+        signal_states = self.input_traffic_light_detections()
+        return traffic_signal_transformer.transform_states(
+            signal_states=signal_states)
+
+    def input_channels(self):
+        """
+        Read the obstacle and traffic light channels in a single pass over all segments of the record.
+        - Messages are consumed while the record is streamed, so only the obstacle tracks and the signal colors are kept in memory.
+        """
+        if self.channels_read:
+            return
+
+        start_time, end_time = self.configuration.record_time_window()
+        obstacle_cache = None
+        obstacle_cache_key = None
+        obstacles_cached = False
+        if self.configuration.obstacle_cache_dir:
+            obstacle_cache = ObstacleTrackCache(
+                cache_dir=self.configuration.obstacle_cache_dir)
+            obstacle_cache_key = ObstacleTrackCache.source_key(
+                CyberRecordReader.find_segments(
+                    self.configuration.apollo_scenario_path))
+            if start_time is not None or end_time is not None:
+                obstacle_cache_key = f"{obstacle_cache_key}-{start_time}-{end_time}"
+            columns = obstacle_cache.load(obstacle_cache_key)
+            if columns is not None:
+                self.obstacle_tracks = ObstacleTracks.from_columns(columns)
+                obstacles_cached = True
+
+        callbacks = {}
+        if not obstacles_cached:
+            callbacks[CyberRecordChannel.
+                      PERCEPTION_OBSTACLES] = self.obstacle_tracks.add
+        if not self.configuration.disable_traffic_signal:
+            callbacks[CyberRecordChannel.
+                      TRAFFIC_LIGHT] = self.traffic_signal_states.add
+
+        if callbacks:
+            CyberRecordReader.read_channels(
+                source_path=self.configuration.apollo_scenario_path,
+                channels=list(callbacks.keys()),
+                callbacks=callbacks,
+                merge_segments=True,
+                workers=self.configuration.record_workers,
+                start_time=start_time,
+                end_time=end_time)
+        self.channels_read = True
+
+        if obstacle_cache and not obstacles_cached:
+            obstacle_cache.save(obstacle_cache_key,
+                                self.obstacle_tracks.to_columns())
 
     def input_routing_request(self) -> RoutingRequest:
         """
         Read RoutingRequest channel first and then read RoutingRequest in RoutingResponse if needed
+        - Only the first message is decoded, reading stops as soon as it is found.
         """
         if self.routing_request:
             return self.routing_request
 
-        routing_requests = CyberRecordReader.read_channel(
+        routing_requests = CyberRecordReader.read_first(
             source_path=self.configuration.apollo_scenario_path,
-            channel=CyberRecordChannel.ROUTING_REQUEST)
+            channel=CyberRecordChannel.ROUTING_REQUEST,
+            merge_segments=True)
         if routing_requests:
             self.routing_request = routing_requests[0]
             return self.routing_request
 
-        routing_responses = CyberRecordReader.read_channel(
+        routing_responses = CyberRecordReader.read_first(
             source_path=self.configuration.apollo_scenario_path,
-            channel=CyberRecordChannel.ROUTING_RESPONSE)
-
-        routing_response = routing_responses[0]
+            channel=CyberRecordChannel.ROUTING_RESPONSE,
+            merge_segments=True)
 
-        self.routing_request = routing_response.routing_request
-
-        if not self.routing_request:
+        if not routing_responses or not routing_responses[0].routing_request:
             raise InvalidScenarioInputError(
                 "No RoutingRequest found in scenario")
 
+        self.routing_request = routing_responses[0].routing_request
         return self.routing_request
 
-    def input_perception_obstacles(self) -> List[PerceptionObstacles]:
-        if self.obstacles:
-            return self.obstacles
+    def input_perception_obstacles(self) -> ObstacleTracks:
+        self.input_channels()
+        return self.obstacle_tracks
 
-        self.obstacles = CyberRecordReader.read_channel(
-            source_path=self.configuration.apollo_scenario_path,
-            channel=CyberRecordChannel.PERCEPTION_OBSTACLES)
-
-        return self.obstacles
-
-    def input_traffic_light_detections(self) -> List[TrafficLightDetection]:
-        if self.traffic_light_detections:
-            return self.traffic_light_detections
-
-        self.traffic_light_detections = CyberRecordReader.read_channel(
-            source_path=self.configuration.apollo_scenario_path,
-            channel=CyberRecordChannel.TRAFFIC_LIGHT)
-
-        return self.traffic_light_detections
+    def input_traffic_light_detections(self) -> TrafficSignalStates:
+        self.input_channels()
+        return self.traffic_signal_states
 
     def input_localization(self) -> List[LocalizationEstimate]:
-
+        """
+        Return the first and the last localization poses of the scenario
+        - Only the first and the last chunk holding localization poses are decoded.
+        - If the configuration sets a record time window, the scenario starts and ends with the poses in the window.
+        """
         if self.localization_poses:
             return self.localization_poses
 
-        self.localization_poses = CyberRecordReader.read_channel(
+        start_time, end_time = self.configuration.record_time_window()
+        first_pose, last_pose = CyberRecordReader.read_first_and_last(
             source_path=self.configuration.apollo_scenario_path,
-            channel=CyberRecordChannel.LOCALIZATION_POSE)
+            channel=CyberRecordChannel.LOCALIZATION_POSE,
+            merge_segments=True,
+            start_time=start_time,
+            end_time=end_time)
 
-        if not self.localization_poses:
+        if first_pose is None or last_pose is None:
             raise InvalidScenarioInputError(
                 "No localization poses found in scenario")
 
-        self.scenario_start_time = self.localization_poses[
-            0].header.timestamp_sec
-        self.scenario_end_time = self.localization_poses[
-            -1].header.timestamp_sec
+        self.localization_poses = [first_pose, last_pose]
+        self.scenario_start_time = first_pose.header.timestamp_sec
+        self.scenario_end_time = last_pose.header.timestamp_sec
 
         return self.localization_poses
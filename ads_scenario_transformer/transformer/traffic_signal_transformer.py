@@ -1,5 +1,5 @@
 import math
-from typing import List, Dict
+from typing import List, Dict, Iterable, Tuple
 from dataclasses import dataclass
 from collections import defaultdict
 from modules.perception.proto.traffic_light_detection_pb2 import TrafficLightDetection, TrafficLight
@@ -22,11 +22,26 @@ class TrafficSignalTransformerResult:
     road_network_traffic: List[TrafficSignalController]
 
 
+class TrafficSignalStates:
+    """
+    Color history per signal id. It is filled one TrafficLightDetection message at a time, so the channel can be streamed instead of being kept in memory.
+    """
+    signal_states: Dict[str, List[Tuple[TrafficLight.Color, float]]]
+
+    def __init__(self):
+        self.signal_states = defaultdict(list)
+
+    def add(self, traffic_light_detection: TrafficLightDetection):
+        timestamp_sec = traffic_light_detection.header.timestamp_sec
+        for signal in traffic_light_detection.traffic_light:
+            self.signal_states[signal.id].append((signal.color, timestamp_sec))
+
+
 class TrafficSignalTransformer(Transformer):
     traffic_signal_mapper: TrafficSignalMapper
     configuration: TrafficSignalTransformerConfiguration
 
-    Source = List[TrafficLightDetection]
+    Source = Iterable[TrafficLightDetection]
     Target = TrafficSignalTransformerResult
 
     def __init__(self, configuration: TrafficSignalTransformerConfiguration):
@@ -36,8 +51,13 @@ class TrafficSignalTransformer(Transformer):
             vector_map_parser=self.configuration.vector_map_parser)
 
     def transform(self, source: Source) -> Target:
+        return self.transform_states(
+            signal_states=self.group_signal_states(
+                traffic_light_detections=source))
+
+    def transform_states(self, signal_states: TrafficSignalStates) -> Target:
         traffic_phases = self.create_traffic_phases(
-            traffic_light_detections=source)
+            signal_states=signal_states)
 
         road_network_controllers = []
         for id, phases in traffic_phases.items():
@@ -50,21 +70,23 @@ class TrafficSignalTransformer(Transformer):
         return TrafficSignalTransformerResult(
             road_network_traffic=road_network_controllers)
 
+    def group_signal_states(
+        self, traffic_light_detections: Iterable[TrafficLightDetection]
+    ) -> TrafficSignalStates:
+        signal_states = TrafficSignalStates()
+        for traffic_light_detection in traffic_light_detections:
+            signal_states.add(traffic_light_detection)
+        return signal_states
+
     def create_traffic_phases(
-        self, traffic_light_detections: List[TrafficLightDetection]
-    ) -> Dict[str, List[Phase]]:
+            self,
+            signal_states: TrafficSignalStates) -> Dict[str, List[Phase]]:
         """
         Create Traffic phases per traffic light id.
         """
 
-        signal_states = defaultdict(list)
-        for traffic_light_detection in traffic_light_detections:
-            timestamp_sec = traffic_light_detection.header.timestamp_sec
-            for signal in traffic_light_detection.traffic_light:
-                signal_states[signal.id].append((signal, timestamp_sec))
-
         traffic_light_states = defaultdict(list)
-        for signal_id, signal_states in signal_states.items():
+        for signal_id, signal_states in signal_states.signal_states.items():
             traffic_light = self.traffic_signal_mapper.traffic_light_id_map[
                 signal_id]
             if traffic_light.id not in traffic_light_states:
@@ -75,14 +97,13 @@ class TrafficSignalTransformer(Transformer):
             phases = []
             start_color = None
             start_timestamp = None
-            for idx, (signal, timestamp) in enumerate(signal_states):
+            for idx, (color, timestamp) in enumerate(signal_states):
                 if not start_color:
-                    start_color = signal.color
+                    start_color = color
                     start_timestamp = timestamp
                     continue
 
-                if start_color != signal.color or idx == len(
-                        signal_states) - 1:
+                if start_color != color or idx == len(signal_states) - 1:
                     duration = math.floor(timestamp - start_timestamp)
 
                     phases.append(
@@ -90,7 +111,7 @@ class TrafficSignalTransformer(Transformer):
                             traffic_light_id=str(traffic_light_id),
                             color=start_color,
                             duration=duration))
-                    start_color = signal.color
+                    start_color = color
                     start_timestamp = timestamp
 
             traffic_phases[traffic_light_id] = phases
@@ -1,14 +1,14 @@
 import sys
-import pickle
 from ads_scenario_transformer.tools.apollo_map_parser import ApolloMapParser
-from modules.map.proto.map_pb2 import Map
 
 
 def gen_map_cache(map_path, output_path):
+    """
+    Write a snapshot of the fully parsed map. Pass output_path (*.pickle) as apollo-map-path to load the map without parsing it again.
+    """
     apollo_parser = ApolloMapParser(filepath=map_path)
-
-    with open(output_path, 'wb') as f:
-        pickle.dump(apollo_parser.get_map(), f)
+    apollo_parser.save_snapshot(snapshot_path=output_path,
+                                source_path=map_path)
 
 
 if __name__ == "__main__":
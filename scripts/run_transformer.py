@@ -1,12 +1,20 @@
 import sys
 import os
 import csv
+import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
 from pathlib import Path
 from dataclasses import dataclass
 import json
 import pprint
 from ads_scenario_transformer.transformer.scenario_transformer import ScenarioTransformer, ScenarioTransformerConfiguration
 from ads_scenario_transformer.openscenario.openscenario_coder import OpenScenarioEncoder
+from ads_scenario_transformer.tools.cyber_record_reader import CyberRecordReader, CyberRecordChannel, RecordSummary
+from ads_scenario_transformer.tools.cyber_record_index import CyberRecordIndex
+from ads_scenario_transformer.tools.map_cache import MapCache
+from ads_scenario_transformer.tools.vector_map_parser import VectorMapParser
 
 
 @dataclass
@@ -32,72 +40,151 @@ def file_has_extension(filename, extension):
     return file_path.suffix == '.' + extension
 
 
+def find_missing_channels(summary: RecordSummary,
+                          use_last_position_as_destination: bool) -> List[str]:
+    """
+    Channels a record needs to be transformed, that the record does not have
+    - The routing request is needed only when the ego destination comes from it, i.e. use_last_position_as_destination is False
+    """
+    missing = []
+    if not summary.has_channel(CyberRecordChannel.LOCALIZATION_POSE):
+        missing.append(CyberRecordChannel.LOCALIZATION_POSE.value)
+    if not summary.has_channel(CyberRecordChannel.PERCEPTION_OBSTACLES):
+        missing.append(CyberRecordChannel.PERCEPTION_OBSTACLES.value)
+    if not use_last_position_as_destination and not summary.has_channel(
+            CyberRecordChannel.ROUTING_REQUEST) and not summary.has_channel(
+                CyberRecordChannel.ROUTING_RESPONSE):
+        missing.append(CyberRecordChannel.ROUTING_REQUEST.value)
+    return missing
+
+
+def quarantine_record(file_path, quarantine_dir):
+    """
+    Move all segments of a record, with their index sidecars, into quarantine_dir
+    """
+    os.makedirs(quarantine_dir, exist_ok=True)
+    for segment in CyberRecordReader.find_segments(file_path):
+        for path in [segment, CyberRecordIndex.sidecar_path(segment)]:
+            if os.path.exists(path):
+                shutil.move(path,
+                            os.path.join(quarantine_dir, os.path.basename(path)))
+
+
+def transform_record(i, full_file_path, config) -> CSVResult:
+    """
+    Transform the record of which full_file_path is the first segment
+    - Records without localization, obstacles or, unless "use-last-position-destination" is set, routing are skipped before loading maps, or moved to "quarantine-dir" if it is set in the config
+    """
+    configuration = ""
+    try:
+        summary = CyberRecordReader.inspect(full_file_path,
+                                            merge_segments=True)
+        missing_channels = find_missing_channels(
+            summary=summary,
+            use_last_position_as_destination=config[
+                "use-last-position-destination"])
+        if missing_channels:
+            message = f"Skipped, no messages in {', '.join(missing_channels)}"
+            if config.get("quarantine-dir"):
+                quarantine_record(full_file_path, config["quarantine-dir"])
+                message = message + ", moved to " + config["quarantine-dir"]
+            print(f"{message}: {full_file_path}")
+            return CSVResult(file_path=full_file_path,
+                             message=message,
+                             configuration="")
+
+        configuration = ScenarioTransformerConfiguration(
+            apollo_scenario_path=full_file_path,
+            apollo_hd_map_path=config["apollo-map-path"],
+            vector_map_path=config["vector-map-path"],
+            road_network_lanelet_map_path=config[
+                "road-network-lanelet-map-path"],
+            road_network_pcd_map_path="point_cloud.pcd",
+            obstacle_direction_change_detection_threshold=0,
+            obstacle_waypoint_frequency_in_sec=config[
+                "obstacle-waypoint-frequency"],
+            disable_traffic_signal=config["disable-traffic-signal"],
+            use_last_position_as_destination=config[
+                "use-last-position-destination"],
+            add_violation_detecting_conditions=config[
+                "add-violation-detecting-conditions"],
+            obstacle_cache_dir=config.get("obstacle-cache-dir"),
+            vector_map_cache_dir=config.get("vector-map-cache-dir"),
+            projection_tolerance=config.get(
+                "projection-tolerance", VectorMapParser.PROJECTION_TOLERANCE),
+            record_workers=config.get("record-workers", 1),
+            record_start_time=config.get("record-start-time"),
+            record_end_time=config.get("record-end-time"))
+
+        transformer = ScenarioTransformer(configuration=configuration)
+        scenario = transformer.transform()
+        scenario_yaml = OpenScenarioEncoder.encode_proto_pyobject_to_yaml(
+            proto_pyobject=scenario, wrap_result_with_typename=False)
+
+        filename = f"{i}_"
+        if config["source-name"]:
+            filename = filename + config["source-name"]
+            filename = filename + "-" + Path(full_file_path).stem
+        else:
+            filename = filename + Path(full_file_path).stem
+
+        output_path = Path(
+            config["output-scenario-path"]) / (filename + ".yaml")
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+
+        print("Configuration")
+        pprint.pprint(vars(configuration), indent=4)
+        print(f"File will saved at {output_path}")
+
+        with open(output_path, 'w') as file:
+            file.write(scenario_yaml)
+        return CSVResult(file_path=str(output_path),
+                         message="Success",
+                         configuration=str(configuration))
+    except Exception as ex:
+        print(f"Error while transforming {full_file_path}, {ex}")
+        return CSVResult(file_path=full_file_path,
+                         message=str(ex),
+                         configuration=str(configuration))
+
+
+def transform_record_in_worker(args) -> CSVResult:
+    return transform_record(*args)
+
+
 def run_scenario_transformer(directory_path, config_path):
     """
     Transform all scenarios in given directory
+    - With "workers" > 1 in the config, records are transformed in forked worker processes. The maps are parsed once before forking and shared with all workers (see MapCache.share_for_workers).
     """
 
     with open(config_path, 'r') as file:
         config = json.load(file)
 
-    results = []
-    configuration = ""
-    output_dir_path = ""
-    for i, filename in sorted(enumerate(os.listdir(directory_path))):
-        full_file_path = os.path.join(directory_path, filename)
-
-        if file_has_extension(full_file_path, "00000"):
-            try:
-                configuration = ScenarioTransformerConfiguration(
-                    apollo_scenario_path=full_file_path,
-                    apollo_hd_map_path=config["apollo-map-path"],
-                    vector_map_path=config["vector-map-path"],
-                    road_network_lanelet_map_path=config[
-                        "road-network-lanelet-map-path"],
-                    road_network_pcd_map_path="point_cloud.pcd",
-                    obstacle_direction_change_detection_threshold=0,
-                    obstacle_waypoint_frequency_in_sec=config[
-                        "obstacle-waypoint-frequency"],
-                    disable_traffic_signal=config["disable-traffic-signal"],
-                    use_last_position_as_destination=config[
-                        "use-last-position-destination"],
-                    add_violation_detecting_conditions=config[
-                        "add-violation-detecting-conditions"])
-
-                transformer = ScenarioTransformer(configuration=configuration)
-                scenario = transformer.transform()
-                scenario_yaml = OpenScenarioEncoder.encode_proto_pyobject_to_yaml(
-                    proto_pyobject=scenario, wrap_result_with_typename=False)
-
-                filename = f"{i}_"
-                if config["source-name"]:
-                    filename = filename + config["source-name"]
-                    filename = filename + "-" + Path(full_file_path).stem
-                else:
-                    filename = filename + Path(full_file_path).stem
-
-                output_path = Path(
-                    config["output-scenario-path"]) / (filename + ".yaml")
-                output_path.parent.mkdir(parents=True, exist_ok=True)
-                output_dir_path = output_path.parent
-
-                print("Configuration")
-                pprint.pprint(vars(configuration), indent=4)
-                print(f"File will saved at {output_path}")
-
-                results.append(
-                    CSVResult(file_path=str(output_path),
-                              message="Success",
-                              configuration=str(configuration)))
-                with open(output_path, 'w') as file:
-                    file.write(scenario_yaml)
-            except Exception as ex:
-                print(f"Error while transforming {full_file_path}, {ex}")
-                results.append(
-                    CSVResult(file_path=full_file_path,
-                              message=str(ex),
-                              configuration=str(configuration)))
-
+    if config.get("map-cache-memory-budget"):
+        MapCache.configure(memory_budget=config["map-cache-memory-budget"])
+
+    # Later segments (.00001, ...) are merged by the reader of the first segment
+    tasks = [(i, os.path.join(directory_path, filename), config)
+             for i, filename in sorted(enumerate(os.listdir(directory_path)))
+             if file_has_extension(filename, "00000")]
+
+    workers = config.get("workers", 1)
+    if workers > 1 and len(tasks) > 1:
+        MapCache.get_apollo_map_parser(config["apollo-map-path"])
+        MapCache.get_vector_map_parser(
+            config["vector-map-path"],
+            map_cache_dir=config.get("vector-map-cache-dir"))
+        MapCache.share_for_workers()
+        with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("fork")) as executor:
+            results = list(executor.map(transform_record_in_worker, tasks))
+    else:
+        results = [transform_record_in_worker(task) for task in tasks]
+
+    output_dir_path = Path(config["output-scenario-path"])
+    output_dir_path.mkdir(parents=True, exist_ok=True)
     write_result(
         result=results,
         filename=f"{output_dir_path.absolute()}/transformation_summary.csv")
@@ -1,4 +1,8 @@
+import os
+from typing import List
+import shutil
 import pytest
+from shapely.geometry import LineString
 from ads_scenario_transformer.tools.apollo_map_parser import ApolloMapParser
 
 
@@ -16,4 +20,146 @@ def test_apollo_map_lane_to_utm(apollo_map_parser):
          lane_id="lane_30", s=0.0)
     assert point2.x == 587040.39095115662
     assert point2.y == 4141553.0670471191
-    assert heading2 == -1.807509475733681
\ No newline at end of file
+    assert heading2 == -1.807509475733681
+
+
+def test_apollo_map_lane_relations(apollo_map_parser):
+    # lane_26 has no successor_id, lane_48 is connected by lane geometry
+    assert len(apollo_map_parser.get_lane_by_id("lane_26").successor_id) == 0
+    assert apollo_map_parser.get_path_from("lane_26") == [[
+        "lane_26", "lane_48", "lane_22"
+    ]]
+
+
+def test_apollo_map_signal_relations(apollo_map_parser):
+    # signal_0 is the first signal of the map and belongs to junction J_0 like the other signals
+    relations = dict(apollo_map_parser.get_signals_wrt("signal_0"))
+    assert relations["signal_13"] == "EQ"
+    assert relations["signal_1"] == "NE"
+
+
+def test_apollo_map_lane_geometry(apollo_map_parser):
+    geometry = apollo_map_parser.get_lane_geometry("lane_26")
+    curve = apollo_map_parser.get_lane_central_curve("lane_26")
+    assert geometry.length == curve.length
+
+    for s in [0.0, geometry.stations[1], 26.2, geometry.length, -1.0]:
+        point, _ = apollo_map_parser.get_coordinate_and_heading(
+            lane_id="lane_26", s=s)
+        expectation = curve.interpolate(s)
+        assert (point.x, point.y) == (expectation.x, expectation.y)
+
+
+def test_apollo_map_heading_for_coordinate(apollo_map_parser):
+    heading = apollo_map_parser.get_heading_for_coordinate(
+        x=586969.5290636807, y=4141286.5458221673)
+    assert heading == -1.9883158777364047
+
+    # cached by quantized coordinate
+    assert apollo_map_parser.get_heading_for_coordinate(
+        x=586969.5290636807 + 1e-5, y=4141286.5458221673) == heading
+
+
+def test_apollo_map_snapshot(borregas_apollo_map_path, tmp_path, monkeypatch):
+    source_path = str(tmp_path / "base_map.bin")
+    shutil.copyfile(borregas_apollo_map_path, source_path)
+    snapshot_path = str(tmp_path / "base_map.pickle")
+
+    parser = ApolloMapParser(filepath=source_path)
+    parser.save_snapshot(snapshot_path=snapshot_path, source_path=source_path)
+
+    snapshot_parser = ApolloMapParser(filepath=snapshot_path)
+    assert snapshot_parser.get_signals_wrt(
+        "signal_0") == parser.get_signals_wrt("signal_0")
+    assert snapshot_parser.get_path_from("lane_26") == parser.get_path_from(
+        "lane_26")
+    assert snapshot_parser.get_coordinate_and_heading(
+        lane_id="lane_26",
+        s=26.2) == parser.get_coordinate_and_heading(lane_id="lane_26",
+                                                      s=26.2)
+
+    # the source map is hashed only when its stat changes
+    def count_source_hash(filepath: str) -> str:
+        hashed_paths.append(filepath)
+        return source_hash(filepath)
+
+    hashed_paths = []
+    source_hash = ApolloMapParser.source_hash
+    monkeypatch.setattr(ApolloMapParser, "source_hash",
+                        staticmethod(count_source_hash))
+    ApolloMapParser(filepath=snapshot_path)
+    assert hashed_paths == []
+
+    os.utime(source_path, ns=(0, 0))
+    ApolloMapParser(filepath=snapshot_path)
+    assert hashed_paths == [source_path]
+    ApolloMapParser(filepath=snapshot_path)
+    assert hashed_paths == [source_path]
+
+    # the snapshot is rebuilt when its source map changes
+    hd_map = parser.get_map()
+    crosswalk_count = len(hd_map.crosswalk)
+    del hd_map.crosswalk[-1]
+    with open(source_path, 'wb') as f:
+        f.write(hd_map.SerializeToString())
+
+    rebuilt_parser = ApolloMapParser(filepath=snapshot_path)
+    assert len(rebuilt_parser.get_map().crosswalk) == crosswalk_count - 1
+
+
+def test_apollo_map_lazy_structures(borregas_apollo_map_path):
+    parser = ApolloMapParser(filepath=borregas_apollo_map_path)
+    assert parser.get_built_structures() == []
+
+    parser.get_coordinate_and_heading(lane_id="lane_26", s=0.0)
+    assert parser.get_built_structures() == ["lanes", "lane_geometries"]
+
+    parser.get_signals_wrt("signal_0")
+    assert "signal_relations" in parser.get_built_structures()
+    assert "lane_relations" not in parser.get_built_structures()
+
+
+def test_apollo_map_share_geometry(borregas_apollo_map_path):
+    parser = ApolloMapParser(filepath=borregas_apollo_map_path)
+    expected = parser.get_coordinate_and_heading(lane_id="lane_26", s=10.0)
+
+    parser.build_all_structures()
+    parser.share_geometry()
+    geometry = parser.get_lane_geometry("lane_26")
+    assert not geometry.vertices.flags.writeable
+    assert parser.get_coordinate_and_heading(lane_id="lane_26",
+                                             s=10.0) == expected
+
+
+def test_apollo_map_conflict_lanes(borregas_apollo_map_path, monkeypatch):
+    parser = ApolloMapParser(filepath=borregas_apollo_map_path)
+    lane_ids = parser.get_lanes()
+
+    # central curves rebuilt from the proto and tested pair by pair, like the implementation before the STRtree
+    curves = {}
+    for lane_id in lane_ids:
+        points = parser.get_lane_by_id(
+            lane_id).central_curve.segment[0].line_segment.point
+        curves[lane_id] = LineString([[point.x, point.y] for point in points])
+
+    def is_pairwise_conflict(lane_ids1: List[str],
+                             lane_ids2: List[str]) -> bool:
+        return any(lane_id1 != lane_id2 and
+                   curves[lane_id1].intersects(curves[lane_id2])
+                   for lane_id1 in lane_ids1 for lane_id2 in lane_ids2)
+
+    for lane_id1 in lane_ids:
+        for lane_id2 in lane_ids:
+            assert parser.is_conflict_lanes(
+                [lane_id1], [lane_id2]) == is_pairwise_conflict([lane_id1],
+                                                                [lane_id2])
+
+    assert "signal_relations" not in parser.get_built_structures()
+
+    pairwise_parser = ApolloMapParser(filepath=borregas_apollo_map_path)
+    monkeypatch.setattr(pairwise_parser, "is_conflict_lanes",
+                        is_pairwise_conflict)
+    for signal_id in parser.get_signals():
+        assert parser.get_signals_wrt(
+            signal_id) == pairwise_parser.get_signals_wrt(signal_id)
+    assert "signal_relations" in parser.get_built_structures()
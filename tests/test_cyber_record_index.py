@@ -0,0 +1,79 @@
+import os
+import shutil
+from cyber_record.reader import Reader
+from ads_scenario_transformer.tools.cyber_record_index import CyberRecordIndex
+from ads_scenario_transformer.tools.cyber_record_reader import CyberRecordReader, CyberRecordChannel
+
+
+def test_record_index_sidecar(borregas_doppel_scenario160_path, tmp_path):
+    source_path = str(tmp_path / "00000160.00000")
+    shutil.copyfile(borregas_doppel_scenario160_path, source_path)
+    sidecar_path = CyberRecordIndex.sidecar_path(source_path)
+
+    traffic_lights = CyberRecordReader.read_channel(
+        source_path=source_path, channel=CyberRecordChannel.TRAFFIC_LIGHT)
+    assert os.path.exists(sidecar_path)
+
+    index = CyberRecordIndex.load(source_path)
+    assert index is not None
+    assert len(index.chunks) == 2
+    assert index.channels[
+        CyberRecordChannel.TRAFFIC_LIGHT.value].message_count == len(
+            traffic_lights) == 300
+    assert index.channels[
+        CyberRecordChannel.PERCEPTION_OBSTACLES.value].message_count == 639
+    assert CyberRecordChannel.LOCALIZATION_POSE.value not in index.channels
+    assert index.chunk_positions(
+        topics={CyberRecordChannel.LOCALIZATION_POSE.value}) == []
+
+    routing_requests = CyberRecordReader.read_channel(
+        source_path=source_path, channel=CyberRecordChannel.ROUTING_REQUEST)
+    assert len(routing_requests) == 1
+
+    stat = os.stat(source_path)
+    os.utime(source_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert CyberRecordIndex.load(source_path) is None
+
+
+def test_record_index_built_while_reading(borregas_doppel_scenario160_path,
+                                          tmp_path, monkeypatch):
+    source_path = str(tmp_path / "00000160.00000")
+    shutil.copyfile(borregas_doppel_scenario160_path, source_path)
+    sidecar_path = CyberRecordIndex.sidecar_path(source_path)
+
+    read_positions = []
+    read_chunk_body = Reader.read_chunk_body
+
+    def counting_read_chunk_body(reader, position):
+        read_positions.append(position)
+        return read_chunk_body(reader, position)
+
+    monkeypatch.setattr(Reader, "read_chunk_body", counting_read_chunk_body)
+
+    # an early exit does not read the whole record, so no index is saved
+    CyberRecordReader.read_first(source_path=source_path,
+                                 channel=CyberRecordChannel.TRAFFIC_LIGHT)
+    assert len(read_positions) == 1
+    assert not os.path.exists(sidecar_path)
+
+    # the first full read builds the index from the chunks it reads anyway
+    read_positions.clear()
+    CyberRecordReader.read_channels(source_path=source_path,
+                                    channels=[
+                                        CyberRecordChannel.TRAFFIC_LIGHT,
+                                        CyberRecordChannel.PERCEPTION_OBSTACLES
+                                    ])
+    assert len(read_positions) == len(set(read_positions)) == 2
+    index = CyberRecordIndex.load(source_path)
+    assert index is not None
+    assert index.channels[
+        CyberRecordChannel.TRAFFIC_LIGHT.value].message_count == 300
+
+    os.remove(sidecar_path)
+    CyberRecordReader.read_channels(
+        source_path=source_path,
+        channels=[CyberRecordChannel.TRAFFIC_LIGHT],
+        workers=2)
+    parallel_index = CyberRecordIndex.load(source_path)
+    assert parallel_index.chunks == index.chunks
+    assert parallel_index.channels == index.channels
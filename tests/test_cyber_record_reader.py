@@ -0,0 +1,388 @@
+import heapq
+import shutil
+from concurrent.futures import Future
+from operator import itemgetter
+from typing import List
+import pytest
+from cyber_record.reader import Reader
+from cyber_record.record import Record
+from ads_scenario_transformer.tools import cyber_record_reader
+from ads_scenario_transformer.tools.cyber_record_index import CyberRecordIndex
+from ads_scenario_transformer.tools.cyber_record_reader import CyberRecordReader, CyberRecordChannel
+
+
+def test_read_channels(borregas_doppel_scenario160_path):
+    channels = [
+        CyberRecordChannel.PERCEPTION_OBSTACLES,
+        CyberRecordChannel.TRAFFIC_LIGHT, CyberRecordChannel.ROUTING_REQUEST
+    ]
+
+    routing_requests = []
+    messages = CyberRecordReader.read_channels(
+        source_path=borregas_doppel_scenario160_path,
+        channels=channels,
+        callbacks={
+            CyberRecordChannel.ROUTING_REQUEST: routing_requests.append
+        })
+
+    assert CyberRecordChannel.ROUTING_REQUEST not in messages
+    assert len(routing_requests) == 1
+
+    for channel in [
+            CyberRecordChannel.PERCEPTION_OBSTACLES,
+            CyberRecordChannel.TRAFFIC_LIGHT
+    ]:
+        expectation = CyberRecordReader.read_channel(
+            source_path=borregas_doppel_scenario160_path, channel=channel)
+        assert [message.SerializeToString() for message in messages[channel]
+                ] == [message.SerializeToString() for message in expectation]
+
+
+def test_iter_channel(borregas_doppel_scenario160_path):
+    messages = CyberRecordReader.iter_channel(
+        source_path=borregas_doppel_scenario160_path,
+        channel=CyberRecordChannel.TRAFFIC_LIGHT)
+
+    first_message = next(messages)
+    assert first_message.HasField("header")
+    assert sum(1 for _ in messages) + 1 == 300
+
+
+def test_find_segments(tmp_path):
+    for filename in [
+            "record.00001", "record.00000", "record.00000.index.json",
+            "record.00010", "other.00000"
+    ]:
+        (tmp_path / filename).touch()
+
+    segments = CyberRecordReader.find_segments(str(tmp_path / "record.00000"))
+    assert segments == [
+        str(tmp_path / "record.00000"),
+        str(tmp_path / "record.00001"),
+        str(tmp_path / "record.00010")
+    ]
+
+
+def test_merge_segments(borregas_doppel_scenario160_path, tmp_path):
+    for segment in ["record.00000", "record.00001"]:
+        shutil.copyfile(borregas_doppel_scenario160_path,
+                        str(tmp_path / segment))
+
+    traffic_lights = CyberRecordReader.read_channel(
+        source_path=borregas_doppel_scenario160_path,
+        channel=CyberRecordChannel.TRAFFIC_LIGHT)
+
+    merged_traffic_lights = CyberRecordReader.read_channels(
+        source_path=str(tmp_path / "record.00000"),
+        channels=[CyberRecordChannel.TRAFFIC_LIGHT],
+        merge_segments=True)[CyberRecordChannel.TRAFFIC_LIGHT]
+
+    assert len(merged_traffic_lights) == 2 * len(traffic_lights)
+    timestamps = [
+        message.header.timestamp_sec for message in merged_traffic_lights
+    ]
+    assert timestamps == sorted(timestamps)
+
+
+@pytest.fixture
+def segmented_record_path(borregas_doppel_scenario160_path, tmp_path) -> str:
+    """
+    The traffic lights and obstacles of a record split into 4 segments following each other in time, of several chunks each
+    """
+    timed_messages = list(
+        CyberRecordReader.iter_timed_messages(
+            source_path=borregas_doppel_scenario160_path,
+            channels=[
+                CyberRecordChannel.TRAFFIC_LIGHT,
+                CyberRecordChannel.PERCEPTION_OBSTACLES
+            ]))
+    segment_count = 4
+    for i in range(segment_count):
+        begin = i * len(timed_messages) // segment_count
+        end = (i + 1) * len(timed_messages) // segment_count
+        with Record(str(tmp_path / f"record.0000{i}"),
+                    'w',
+                    chunk_threshold=20000) as record:
+            for time, channel, message in timed_messages[begin:end]:
+                record.write(channel.value, message, time)
+    return str(tmp_path / "record.00000")
+
+
+@pytest.fixture
+def read_positions(monkeypatch) -> List[int]:
+    """
+    Positions of the chunk bodies read by any Reader
+    """
+    positions = []
+    read_chunk_body = Reader.read_chunk_body
+
+    def counting_read_chunk_body(reader, position):
+        positions.append(position)
+        return read_chunk_body(reader, position)
+
+    monkeypatch.setattr(Reader, "read_chunk_body", counting_read_chunk_body)
+    return positions
+
+
+def test_merge_segments_in_time_order(segmented_record_path, read_positions):
+    channels = [
+        CyberRecordChannel.TRAFFIC_LIGHT,
+        CyberRecordChannel.PERCEPTION_OBSTACLES
+    ]
+    segment_streams = [
+        CyberRecordReader.iter_timed_messages(source_path=segment,
+                                              channels=channels)
+        for segment in CyberRecordReader.find_segments(segmented_record_path)
+    ]
+    expectation = [(time, channel, message.SerializeToString())
+                   for time, channel, message in heapq.merge(
+                       *segment_streams, key=itemgetter(0))]
+
+    merged = [
+        (time, channel, message.SerializeToString())
+        for time, channel, message in CyberRecordReader.iter_merged_segments(
+            segments=CyberRecordReader.find_segments(segmented_record_path),
+            channels=channels)
+    ]
+    assert merged == expectation
+
+    # the first message comes from the first chunk of the first segment only
+    read_positions.clear()
+    next(
+        CyberRecordReader.iter_channels(source_path=segmented_record_path,
+                                        channels=channels,
+                                        merge_segments=True))
+    assert len(read_positions) == 1
+
+
+def test_read_first(borregas_doppel_scenario160_path):
+    traffic_lights = CyberRecordReader.read_channel(
+        source_path=borregas_doppel_scenario160_path,
+        channel=CyberRecordChannel.TRAFFIC_LIGHT)
+
+    first_traffic_lights = CyberRecordReader.read_first(
+        source_path=borregas_doppel_scenario160_path,
+        channel=CyberRecordChannel.TRAFFIC_LIGHT,
+        count=3)
+    assert [
+        message.SerializeToString() for message in first_traffic_lights
+    ] == [message.SerializeToString() for message in traffic_lights[:3]]
+
+    later_traffic_lights = CyberRecordReader.read_first(
+        source_path=borregas_doppel_scenario160_path,
+        channel=CyberRecordChannel.TRAFFIC_LIGHT,
+        predicate=lambda message: message.header.timestamp_sec >
+        traffic_lights[100].header.timestamp_sec)
+    assert later_traffic_lights[0].header.timestamp_sec == traffic_lights[
+        101].header.timestamp_sec
+
+    assert CyberRecordReader.read_first(
+        source_path=borregas_doppel_scenario160_path,
+        channel=CyberRecordChannel.LOCALIZATION_POSE) == []
+
+
+def test_read_first_segments(segmented_record_path, read_positions):
+    # no segment has the channel in its header, no chunk is read even without index sidecars
+    assert CyberRecordReader.read_first(
+        source_path=segmented_record_path,
+        channel=CyberRecordChannel.LOCALIZATION_POSE,
+        merge_segments=True) == []
+    assert read_positions == []
+
+    traffic_lights = CyberRecordReader.read_first(
+        source_path=segmented_record_path,
+        channel=CyberRecordChannel.TRAFFIC_LIGHT,
+        count=float('inf'),
+        merge_segments=True)
+    with Record(segmented_record_path) as record:
+        first_segment_chunk_count = len(record._reader.sorted_chunk_indexs)
+        first_segment_traffic_light_count = record._reader.channels[
+            CyberRecordChannel.TRAFFIC_LIGHT.value].message_number
+
+    read_positions.clear()
+    first = CyberRecordReader.read_first(
+        source_path=segmented_record_path,
+        channel=CyberRecordChannel.TRAFFIC_LIGHT,
+        merge_segments=True)
+    assert [message.SerializeToString()
+            for message in first] == [traffic_lights[0].SerializeToString()]
+    assert len(read_positions) == 1
+
+    # one more message than the first segment holds, read from the first chunk of the second segment
+    read_positions.clear()
+    count = first_segment_traffic_light_count + 1
+    first = CyberRecordReader.read_first(
+        source_path=segmented_record_path,
+        channel=CyberRecordChannel.TRAFFIC_LIGHT,
+        count=count,
+        merge_segments=True)
+    assert [message.SerializeToString() for message in first] == [
+        message.SerializeToString() for message in traffic_lights[:count]
+    ]
+    assert len(read_positions) == first_segment_chunk_count + 1
+
+
+def test_read_first_and_last(borregas_doppel_scenario160_path):
+    traffic_lights = CyberRecordReader.read_channel(
+        source_path=borregas_doppel_scenario160_path,
+        channel=CyberRecordChannel.TRAFFIC_LIGHT)
+
+    first, last = CyberRecordReader.read_first_and_last(
+        source_path=borregas_doppel_scenario160_path,
+        channel=CyberRecordChannel.TRAFFIC_LIGHT)
+    assert first.SerializeToString() == traffic_lights[0].SerializeToString()
+    assert last.SerializeToString() == traffic_lights[-1].SerializeToString()
+
+    assert CyberRecordReader.read_first_and_last(
+        source_path=borregas_doppel_scenario160_path,
+        channel=CyberRecordChannel.LOCALIZATION_POSE) == (None, None)
+
+
+def test_read_channels_parallel(borregas_doppel_scenario160_path):
+    channels = [
+        CyberRecordChannel.PERCEPTION_OBSTACLES,
+        CyberRecordChannel.TRAFFIC_LIGHT
+    ]
+    serial = CyberRecordReader.read_channels(
+        source_path=borregas_doppel_scenario160_path, channels=channels)
+    parallel = CyberRecordReader.read_channels(
+        source_path=borregas_doppel_scenario160_path,
+        channels=channels,
+        workers=2)
+
+    for channel in channels:
+        assert [
+            message.SerializeToString() for message in parallel[channel]
+        ] == [message.SerializeToString() for message in serial[channel]]
+
+    first = CyberRecordReader.read_channel(
+        source_path=borregas_doppel_scenario160_path,
+        channel=CyberRecordChannel.PERCEPTION_OBSTACLES,
+        max_count=3,
+        workers=2)
+    assert [message.SerializeToString() for message in first] == [
+        message.SerializeToString()
+        for message in serial[CyberRecordChannel.PERCEPTION_OBSTACLES][:3]
+    ]
+
+
+def test_read_channels_parallel_in_flight(borregas_doppel_scenario160_path,
+                                          monkeypatch):
+
+    class SerialExecutor:
+        """
+        Runs each batch on submit and counts the batches not consumed yet
+        """
+        in_flight = 0
+        max_in_flight = 0
+
+        def __init__(self, max_workers):
+            pass
+
+        def submit(self, fn, *args):
+            SerialExecutor.in_flight += 1
+            SerialExecutor.max_in_flight = max(SerialExecutor.max_in_flight,
+                                               SerialExecutor.in_flight)
+            future = ConsumedFuture()
+            future.set_result(fn(*args))
+            return future
+
+        def shutdown(self, wait, cancel_futures):
+            pass
+
+    class ConsumedFuture(Future):
+
+        def result(self, timeout=None):
+            SerialExecutor.in_flight -= 1
+            return super().result(timeout)
+
+    monkeypatch.setattr(cyber_record_reader, "ProcessPoolExecutor",
+                        SerialExecutor)
+
+    channel_by_topic = {
+        CyberRecordChannel.TRAFFIC_LIGHT.value:
+        CyberRecordChannel.TRAFFIC_LIGHT
+    }
+    with Record(borregas_doppel_scenario160_path) as record:
+        index = CyberRecordIndex.from_chunk_headers(
+            source_path=borregas_doppel_scenario160_path, record=record)
+        # the chunks of the record many times over, one batch per chunk
+        chunks = index.chunks * 20
+        messages = list(
+            CyberRecordReader.iter_parallel_messages(
+                source_path=borregas_doppel_scenario160_path,
+                reader=record._reader,
+                chunks=chunks,
+                channel_by_topic=channel_by_topic,
+                workers=2,
+                batches_per_worker=len(chunks)))
+
+    assert len(messages) == 20 * 300
+    assert SerialExecutor.max_in_flight == 4
+
+
+def test_inspect(borregas_doppel_scenario160_path, tmp_path, read_positions):
+    source_path = str(tmp_path / "00000160.00000")
+    shutil.copyfile(borregas_doppel_scenario160_path, source_path)
+    channel = CyberRecordChannel.PERCEPTION_OBSTACLES
+
+    # Without the index sidecar, channel times are the record bounds
+    summary = CyberRecordReader.inspect(source_path)
+    assert read_positions == []
+    assert summary.has_channel(CyberRecordChannel.ROUTING_REQUEST)
+    assert not summary.has_channel(CyberRecordChannel.PLANNING)
+    channel_summary = summary.channels[channel.value]
+    assert channel_summary.begin_time == summary.begin_time
+    assert channel_summary.end_time == summary.end_time
+
+    # With the index sidecar written by a full read, channel times are exact
+    times = [
+        time for time, _, _ in CyberRecordReader.iter_timed_messages(
+            source_path=source_path, channels=[channel])
+    ]
+    assert CyberRecordIndex.load(source_path) is not None
+    read_positions.clear()
+
+    summary = CyberRecordReader.inspect(source_path)
+    assert read_positions == []
+    channel_summary = summary.channels[channel.value]
+    assert channel_summary.message_count == len(times)
+    assert channel_summary.begin_time == min(times)
+    assert channel_summary.end_time == max(times)
+
+
+def test_read_channel_time_window(borregas_doppel_scenario160_path):
+    channel = CyberRecordChannel.PERCEPTION_OBSTACLES
+    timed_messages = list(
+        CyberRecordReader.iter_timed_messages(
+            source_path=borregas_doppel_scenario160_path, channels=[channel]))
+    start_time = timed_messages[len(timed_messages) // 4][0]
+    end_time = timed_messages[len(timed_messages) // 2][0]
+    expectation = [
+        message.SerializeToString() for time, _, message in timed_messages
+        if start_time <= time <= end_time
+    ]
+
+    messages = CyberRecordReader.read_channel(
+        source_path=borregas_doppel_scenario160_path,
+        channel=channel,
+        start_time=start_time,
+        end_time=end_time)
+    assert [message.SerializeToString() for message in messages] == expectation
+
+    parallel = CyberRecordReader.read_channels(
+        source_path=borregas_doppel_scenario160_path,
+        channels=[channel],
+        workers=2,
+        start_time=start_time,
+        end_time=end_time)
+    assert [message.SerializeToString()
+            for message in parallel[channel]] == expectation
+
+    first, last = CyberRecordReader.read_first_and_last(
+        source_path=borregas_doppel_scenario160_path,
+        channel=channel,
+        start_time=start_time,
+        end_time=end_time)
+    assert first.SerializeToString() == expectation[0]
+    assert last.SerializeToString() == expectation[-1]
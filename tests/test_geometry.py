@@ -1,10 +1,16 @@
 from typing import List, Dict, Set
+import dataclasses
+import math
+import numpy as np
 import pytest
-from lanelet2.core import BasicPoint3d, Lanelet
+from lanelet2.core import BasicPoint2d, BasicPoint3d, Lanelet, LaneletMap, LineString3d, Point3d, getId
+from lanelet2.geometry import toArcCoordinates, to2D
 from lanelet2.routing import LaneletPath
 from modules.common.proto.geometry_pb2 import PointENU, Point3D
 from openscenario_msgs import LanePosition
-from ads_scenario_transformer.tools.geometry import Geometry
+from ads_scenario_transformer.tools.geometry import Geometry, LaneCorridor
+from ads_scenario_transformer.tools.lanelet_index import LaneletIndex
+from ads_scenario_transformer.tools.vector_map_parser import VectorMapParser
 from modules.perception.proto.perception_obstacle_pb2 import PerceptionObstacles
 from ads_scenario_transformer.tools.cyber_record_reader import CyberRecordReader, CyberRecordChannel
 from ads_scenario_transformer.builder.entities_builder import ASTEntityType, ASTEntity
@@ -32,7 +38,27 @@ def test_projection(mgrs_projector):
         ) <= 1.0, "projected point.y is not equal to the expectation"
 
 
+def test_projection_batch(mgrs_projector):
+    poses = [
+        PointENU(x=587079.3045861976, y=4141574.299574421, z=0),
+        PointENU(x=587044.4300003723, y=4141550.060588833, z=-1.5)
+    ]
+
+    projected = Geometry.project_UTM_points_on_lanelet(
+        points=Geometry.to_array(poses), projector=mgrs_projector)
+    assert projected.shape == (2, 3)
+    for pose, (x, y, z) in zip(poses, projected):
+        expectation = Geometry.project_UTM_point_on_lanelet(
+            point=pose, projector=mgrs_projector)
+        assert (x, y, z) == (expectation.x, expectation.y, expectation.z)
+
+    assert Geometry.project_UTM_points_on_lanelet(
+        points=Geometry.to_array([]), projector=mgrs_projector).shape == (0,
+                                                                          3)
+
+
 def test_geometry(lanelet_map, entities):
+    lanelet_index = LaneletIndex(lanelet_map)
     basic_points = [
         BasicPoint3d(86973.4293, 41269.817, -5.6757),
         BasicPoint3d(86993.2289, 41343.5182, -4.5032),
@@ -57,7 +83,7 @@ def test_geometry(lanelet_map, entities):
         ego_bounding_box = entities.scenarioObjects[
             0].entityObject.vehicle.boundingBox
         target_lane_position = Geometry.nearest_lane_position(
-            map=lanelet_map,
+            lanelet_index=lanelet_index,
             lanelet=lanelet,
             basic_point=basic_point,
             entity_bounding_box=ego_bounding_box)
@@ -147,3 +173,141 @@ def test_find_available_lanes_pedestrian(obstacles, vector_map_parser,
     lane_id = [lanelet.id for lanelet in lanelets]
 
     assert 643 in lane_id
+
+
+def test_affine_projection(vector_map_parser):
+    poses = [
+        PointENU(x=587079.3045861976, y=4141574.299574421, z=0),
+        PointENU(x=587044.4300003723, y=4141550.060588833, z=-1.5),
+        # outside of the map
+        PointENU(x=500000.0, y=4000000.0, z=0)
+    ]
+    points = Geometry.to_array(poses)
+    exact = Geometry.project_UTM_points_on_lanelet(
+        points=points, projector=vector_map_parser.projector)
+
+    affine_projection = Geometry.affine_projection(vector_map_parser)
+    assert affine_projection is not None
+    assert affine_projection.error_bound <= VectorMapParser.PROJECTION_TOLERANCE
+    assert list(affine_projection.covers(points)) == [True, True, False]
+
+    projected = Geometry.project_UTM_points(
+        vector_map_parser=vector_map_parser, points=points)
+    assert abs(projected - exact).max() <= affine_projection.error_bound
+    assert list(projected[2]) == list(exact[2])
+
+    assert Geometry.affine_projection(vector_map_parser,
+                                      projection_tolerance=0.0) is None
+    assert (Geometry.project_UTM_points(vector_map_parser=vector_map_parser,
+                                        points=points,
+                                        projection_tolerance=0.0) == exact).all()
+    # the tolerance of a caller does not change the projection of the others
+    assert (Geometry.project_UTM_points(vector_map_parser=vector_map_parser,
+                                        points=points) == projected).all()
+
+    # 0 disables the affine projection even when the fit is exact
+    vector_map_parser.affine_projections[10] = dataclasses.replace(
+        affine_projection, error_bound=0.0)
+    assert Geometry.affine_projection(vector_map_parser,
+                                      projection_tolerance=0.0) is None
+    assert Geometry.affine_projection(vector_map_parser) is not None
+
+
+def test_lane_corridor(vector_map_parser):
+    lanelets = vector_map_parser.lanelet_index.lanelets
+
+    def center(lanelet_id: int) -> BasicPoint3d:
+        centerline = lanelets[lanelet_id].centerline
+        point = centerline[len(centerline) // 2]
+        return BasicPoint3d(point.x, point.y, point.z)
+
+    lane_corridor = LaneCorridor(vector_map_parser=vector_map_parser,
+                                 start_point=center(22),
+                                 end_point=center(104),
+                                 entity_type=ASTEntityType.CAR)
+
+    target_lanelets = Geometry.find_close_lanelets(
+        lanelet_index=vector_map_parser.lanelet_index,
+        basic_point=center(210),
+        entity_type=ASTEntityType.CAR)
+    available_lanelets = lane_corridor.available_lanelets(
+        target_lanelets=target_lanelets)
+    assert {22, 210, 192, 104} <= set(available_lanelets)
+    assert lane_corridor.available_lanelets(
+        target_lanelets=target_lanelets) is available_lanelets
+
+    assert set(available_lanelets) == {
+        lanelet.id
+        for lanelet in Geometry.find_available_lanes(
+            vector_map_parser=vector_map_parser,
+            start_point=center(22),
+            end_point=center(104),
+            target_point=center(210),
+            entity_type=ASTEntityType.CAR)
+    }
+
+
+def test_find_close_lanelets_far_from_subtype():
+    lanelet_map = LaneletMap()
+
+    def add_lanelet(x: float, y: float, subtype: str) -> Lanelet:
+        left = LineString3d(
+            getId(),
+            [Point3d(getId(), x, y, 0),
+             Point3d(getId(), x + 10, y, 0)])
+        right = LineString3d(
+            getId(),
+            [Point3d(getId(), x, y - 3, 0),
+             Point3d(getId(), x + 10, y - 3, 0)])
+        lanelet = Lanelet(getId(), left, right)
+        lanelet.attributes["subtype"] = subtype
+        lanelet_map.add(lanelet)
+        return lanelet
+
+    for i in range(30):
+        add_lanelet(0, i * 10.0, "road")
+    # farther than all roads from the point
+    crosswalk = add_lanelet(1000, 1000, "crosswalk")
+
+    lanelets = Geometry.find_close_lanelets(
+        lanelet_index=LaneletIndex(lanelet_map),
+        basic_point=BasicPoint3d(5, 0, 0),
+        entity_type=ASTEntityType.PEDESTRIAN)
+    assert [lanelet.id for lanelet in lanelets] == [crosswalk.id]
+
+
+def test_nearest_lane_position_on_curved_lane(entities):
+    # quarter circle turning left, radius 20 on the centerline
+    left = LineString3d(getId(), [
+        Point3d(getId(), 17 * math.sin(angle), 20 - 17 * math.cos(angle), 0)
+        for angle in np.linspace(0, math.pi / 2, 31)
+    ])
+    right = LineString3d(getId(), [
+        Point3d(getId(), 23 * math.sin(angle), 20 - 23 * math.cos(angle), 0)
+        for angle in np.linspace(0, math.pi / 2, 31)
+    ])
+    lanelet = Lanelet(getId(), left, right)
+    lanelet_map = LaneletMap()
+    lanelet_map.add(lanelet)
+    lanelet_index = LaneletIndex(lanelet_map)
+
+    bounding_box = entities.scenarioObjects[0].entityObject.vehicle.boundingBox
+    angle = math.pi / 6
+    # 1m left of the centerline, a third of the way along the turn
+    lane_position = Geometry.nearest_lane_position(
+        lanelet_index=lanelet_index,
+        lanelet=lanelet,
+        basic_point=BasicPoint3d(19 * math.sin(angle),
+                                 20 - 19 * math.cos(angle), 0),
+        entity_bounding_box=bounding_box)
+    assert lane_position.laneId == str(lanelet.id)
+    assert lane_position.s == pytest.approx(20 * angle, abs=0.05)
+    assert lane_position.offset == pytest.approx(1.0, abs=0.05)
+
+    s, offset = lanelet_index.centerline(lanelet).arc_coordinates(
+        19 * math.sin(angle), 20 - 19 * math.cos(angle))
+    expectation = toArcCoordinates(to2D(lanelet.centerline),
+                                   BasicPoint2d(19 * math.sin(angle),
+                                                20 - 19 * math.cos(angle)))
+    assert s == pytest.approx(expectation.length)
+    assert offset == pytest.approx(expectation.distance)
@@ -0,0 +1,74 @@
+import os
+import shutil
+import pytest
+from ads_scenario_transformer.tools.map_cache import MapCache
+from ads_scenario_transformer.tools.apollo_map_parser import ApolloMapParser
+
+
+@pytest.fixture
+def map_cache():
+    MapCache.clear()
+    memory_budget = MapCache.memory_budget
+    yield MapCache
+    MapCache.configure(memory_budget=memory_budget)
+    MapCache.clear()
+
+
+def test_map_cache(map_cache, borregas_apollo_map_path, tmp_path):
+    shalun_apollo_map_path = borregas_apollo_map_path.replace(
+        "BorregasAve", "Shalun")
+
+    borregas = map_cache.get_apollo_map_parser(borregas_apollo_map_path)
+    shalun = map_cache.get_apollo_map_parser(shalun_apollo_map_path)
+    assert borregas is not shalun
+    assert ApolloMapParser.get_instance() is shalun
+    assert map_cache.get_apollo_map_parser(borregas_apollo_map_path) is borregas
+    assert ApolloMapParser.get_instance() is borregas
+    assert (map_cache.stats.hits, map_cache.stats.misses) == (1, 2)
+
+    # a changed map file is parsed again
+    copied_map_path = str(tmp_path / "base_map.bin")
+    shutil.copyfile(borregas_apollo_map_path, copied_map_path)
+    copied = map_cache.get_apollo_map_parser(copied_map_path)
+    os.utime(copied_map_path, ns=(0, 0))
+    assert map_cache.get_apollo_map_parser(copied_map_path) is not copied
+    assert len(map_cache.entries) == 3
+
+    # the least recently used maps are evicted to fit the memory budget
+    evictions = map_cache.stats.evictions
+    map_cache.configure(
+        memory_budget=os.path.getsize(borregas_apollo_map_path) *
+        MapCache.APOLLO_MAP_SIZE_FACTOR)
+    assert len(map_cache.entries) == 1
+    assert map_cache.stats.evictions == evictions + 2
+
+
+def test_map_cache_replaces_changed_map(map_cache, borregas_vector_map_path,
+                                        tmp_path):
+    copied_map_path = str(tmp_path / "lanelet2_map.osm")
+    shutil.copyfile(borregas_vector_map_path, copied_map_path)
+    first = map_cache.get_vector_map_parser(copied_map_path)
+
+    # rewrite the map file, the parser of the previous content is dropped
+    with open(copied_map_path, 'ab') as f:
+        f.write(b"\n")
+    second = map_cache.get_vector_map_parser(copied_map_path)
+    assert second is not first
+    assert len(map_cache.entries) == 1
+    assert map_cache.get_vector_map_parser(copied_map_path) is second
+    assert len(map_cache.entries) == 1
+
+
+def test_map_cache_evicts_apollo_instance(map_cache, borregas_apollo_map_path,
+                                          borregas_vector_map_path):
+    apollo = map_cache.get_apollo_map_parser(borregas_apollo_map_path)
+    assert ApolloMapParser.get_instance() is apollo
+
+    # the evicted parser is no longer reachable through the singleton
+    map_cache.configure(
+        memory_budget=os.path.getsize(borregas_vector_map_path) *
+        MapCache.VECTOR_MAP_SIZE_FACTOR)
+    map_cache.get_vector_map_parser(borregas_vector_map_path)
+    assert len(map_cache.entries) == 1
+    with pytest.raises(AssertionError):
+        ApolloMapParser.get_instance()
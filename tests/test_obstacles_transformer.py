@@ -1,10 +1,13 @@
+import os
 import math
+import shutil
 from typing import List
 import pytest
 from modules.perception.proto.perception_obstacle_pb2 import PerceptionObstacles
 from ads_scenario_transformer.tools.cyber_record_reader import CyberRecordReader, CyberRecordChannel
 from ads_scenario_transformer.tools.error import LaneFindingError
-from ads_scenario_transformer.transformer.obstacles_transformer import ObstaclesTransformer, ObstaclesTransformerConfiguration
+from ads_scenario_transformer.tools.obstacle_track_cache import ObstacleTrackCache
+from ads_scenario_transformer.transformer.obstacles_transformer import ObstaclesTransformer, ObstaclesTransformerConfiguration, ObstacleTrack, ObstacleTracks
 
 
 @pytest.fixture
@@ -70,3 +73,72 @@ def test_obstacle_transformer2(perception_obstacles10, vector_map_parser):
         id = waypoint.position.lanePosition.laneId
         if id not in available_lane_id:
             assert False, f"Lane id {id} is not available"
+
+
+@pytest.fixture
+def obstacle_tracks(borregas_doppel_scenario160_path) -> ObstacleTracks:
+    obstacle_tracks = ObstacleTracks()
+    for perception_obstacles in CyberRecordReader.iter_channel(
+            source_path=borregas_doppel_scenario160_path,
+            channel=CyberRecordChannel.PERCEPTION_OBSTACLES):
+        obstacle_tracks.add(perception_obstacles)
+    return obstacle_tracks
+
+
+def test_obstacle_tracks(obstacle_tracks, borregas_doppel_scenario160_path):
+    assert obstacle_tracks.error_code == 0
+
+    expectations = {}
+    for perception_obstacles in CyberRecordReader.iter_channel(
+            source_path=borregas_doppel_scenario160_path,
+            channel=CyberRecordChannel.PERCEPTION_OBSTACLES):
+        for obstacle in perception_obstacles.perception_obstacle:
+            expectations.setdefault(obstacle.id, []).append(obstacle)
+
+    assert list(obstacle_tracks.tracks.keys()) == list(expectations.keys())
+    for id, obstacles in obstacle_tracks.tracks.items():
+        assert isinstance(obstacles, ObstacleTrack)
+        assert len(obstacles) == len(expectations[id])
+        for obstacle, expectation in zip(obstacles, expectations[id]):
+            assert obstacle.id == id
+            assert obstacle.timestamp == expectation.timestamp
+            assert obstacle.position.y == expectation.position.y
+            assert obstacle.theta == expectation.theta
+            assert obstacle.velocity.x == expectation.velocity.x
+            assert obstacle.type == expectation.type
+            assert obstacle.height == expectation.height
+        assert obstacles[-1].timestamp == expectations[id][-1].timestamp
+        assert [obstacle.timestamp for obstacle in obstacles[1:]] == [
+            obstacle.timestamp for obstacle in expectations[id][1:]
+        ]
+
+
+def test_obstacle_tracks_cache(obstacle_tracks,
+                               borregas_doppel_scenario160_path, tmp_path):
+    cache = ObstacleTrackCache(cache_dir=str(tmp_path))
+    key = ObstacleTrackCache.source_key([borregas_doppel_scenario160_path])
+    assert key == ObstacleTrackCache.source_key(
+        [borregas_doppel_scenario160_path])
+    assert cache.load(key) is None
+
+    copy_path = str(tmp_path / "00000160.00000")
+    shutil.copyfile(borregas_doppel_scenario160_path, copy_path)
+    copy_key = ObstacleTrackCache.source_key([copy_path])
+    assert copy_key != key
+    os.utime(copy_path, ns=(0, 0))
+    assert ObstacleTrackCache.source_key([copy_path]) != copy_key
+
+    cache.save(key, obstacle_tracks.to_columns())
+    cached_tracks = ObstacleTracks.from_columns(cache.load(key))
+
+    assert cached_tracks.error_code == obstacle_tracks.error_code
+    assert list(cached_tracks.tracks.keys()) == list(
+        obstacle_tracks.tracks.keys())
+    for id, obstacles in obstacle_tracks.tracks.items():
+        for obstacle, cached_obstacle in zip(obstacles,
+                                             cached_tracks.tracks[id]):
+            assert cached_obstacle.timestamp == obstacle.timestamp
+            assert cached_obstacle.position.x == obstacle.position.x
+            assert cached_obstacle.velocity.y == obstacle.velocity.y
+            assert cached_obstacle.type == obstacle.type
+            assert cached_obstacle.length == obstacle.length
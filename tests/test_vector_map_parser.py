@@ -0,0 +1,97 @@
+import os
+from lanelet2.traffic_rules import Participants
+from ads_scenario_transformer.tools.vector_map_parser import VectorMapParser
+from ads_scenario_transformer.builder.entities_builder import ASTEntityType
+
+
+def test_vector_map_routing_graph(vector_map_parser):
+    assert vector_map_parser.routing_graphs == {}
+
+    vehicle_graph = vector_map_parser.routing_graph(ASTEntityType.CAR)
+    assert vector_map_parser.routing_graph(ASTEntityType.EGO) is vehicle_graph
+    assert vector_map_parser.routing_graph(
+        ASTEntityType.BICYCLE) is vehicle_graph
+    assert list(vector_map_parser.routing_graphs) == [Participants.Vehicle]
+
+    pedestrian_graph = vector_map_parser.routing_graph(
+        ASTEntityType.PEDESTRIAN)
+    assert pedestrian_graph is not vehicle_graph
+
+
+def test_vector_map_cache(borregas_vector_map_path, tmp_path):
+    parser = VectorMapParser(borregas_vector_map_path,
+                             map_cache_dir=str(tmp_path))
+    cache_path = parser.cache_path(borregas_vector_map_path)
+    assert os.listdir(tmp_path) == [os.path.basename(cache_path)]
+
+    cached = VectorMapParser(borregas_vector_map_path,
+                             map_cache_dir=str(tmp_path))
+    lanelets = {
+        lanelet.id: lanelet
+        for lanelet in parser.lanelet_map.laneletLayer
+    }
+    cached_lanelets = {
+        lanelet.id: lanelet
+        for lanelet in cached.lanelet_map.laneletLayer
+    }
+    assert lanelets.keys() == cached_lanelets.keys()
+    for id, lanelet in lanelets.items():
+        assert dict(lanelet.attributes) == dict(
+            cached_lanelets[id].attributes)
+        assert [(p.x, p.y) for p in lanelet.centerline
+                ] == [(p.x, p.y) for p in cached_lanelets[id].centerline]
+
+
+def test_lanelet_index(vector_map_parser):
+    lanelet_index = vector_map_parser.lanelet_index
+    assert vector_map_parser.lanelet_index is lanelet_index
+    assert len(lanelet_index.lanelets) == len(
+        vector_map_parser.lanelet_map.laneletLayer)
+
+    intersections = vector_map_parser.get_all_intersections()
+    assert intersections[210] == "left"
+    assert all(
+        vector_map_parser.lanelet_map.laneletLayer[id].
+        attributes["turn_direction"] == turn_direction
+        for id, turn_direction in intersections.items())
+
+    assert [
+        lanelet.id
+        for lanelet in vector_map_parser.get_lanelets([22, 643, 22, -1])
+    ] == [22, 643]
+
+    crosswalk = lanelet_index.lanelets[643]
+    assert lanelet_index.has_subtype(crosswalk, ASTEntityType.PEDESTRIAN)
+    assert not lanelet_index.has_subtype(crosswalk, ASTEntityType.CAR)
+    assert {
+        lanelet.id
+        for lanelet in lanelet_index.subtype_maps[
+            ASTEntityType.PEDESTRIAN].laneletLayer
+    } == lanelet_index.subtype_ids[ASTEntityType.PEDESTRIAN]
+
+
+def test_vector_map_shortest_path(vector_map_parser):
+    lanelets = vector_map_parser.lanelet_index.lanelets
+
+    path = vector_map_parser.shortest_path(type=ASTEntityType.CAR,
+                                           start_lanelet=lanelets[22],
+                                           end_lanelet=lanelets[104])
+    assert [lanelet.id for lanelet in path] == [22, 210, 192, 104]
+    assert vector_map_parser.shortest_path(
+        type=ASTEntityType.CAR,
+        start_lanelet=lanelets[104],
+        end_lanelet=lanelets[22]) is None
+
+    # routes are cached per routing graph
+    assert vector_map_parser.shortest_path(
+        type=ASTEntityType.EGO,
+        start_lanelet=lanelets[22],
+        end_lanelet=lanelets[104]) is path
+    assert len(vector_map_parser.routes) == 2
+
+    via_path = vector_map_parser.shortest_path(type=ASTEntityType.CAR,
+                                               start_lanelet=lanelets[22],
+                                               end_lanelet=lanelets[104],
+                                               via_lanelets=[lanelets[192]])
+    assert [lanelet.id for lanelet in via_path] == [22, 210, 192, 104]
+    assert len(vector_map_parser.routes) == 3